@@ -1,86 +1,276 @@
 # How to use the CDS API:
 # https://cds.climate.copernicus.eu/api-how-to
 
+"""Download the ERA5 vertical integrals of east-/northward water vapour flux.
+
+Each year is requested in chunks of months, several chunks are downloaded
+concurrently, and the chunks are merged into one "{year}.nc" file per
+variable. Chunks and years that are already complete (readable, with the
+expected number of hourly time steps) are skipped, so that an interrupted
+download can be resumed by running the script again.
+"""
+
 import os
+import time
 import argparse
+import importlib
+import threading
+import multiprocessing
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                as_completed)
+
 import yaml
+import pandas as pd
+import xarray as xr
+from netCDF4 import Dataset
 
-import cdsapi
-
-# argument parameters
-parser = argparse.ArgumentParser(
-    description=__doc__,
-    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-)
-parser.add_argument(
-    '--config', '-c',
-    type=str,
-    help='path to the config.yml file',
-    default=os.path.join(os.getcwd(), 'config.yml'),
-)
-args = parser.parse_args()
-
-# load config
-config = yaml.safe_load(open(args.config))
-
-# parameters
-years = range(config['year_start'], config['year_end'] + 1)
 variables = [
     'vertical_integral_of_eastward_water_vapour_flux',
     'vertical_integral_of_northward_water_vapour_flux',
 ]
 
-# filesystem
-data_folder_e = config['data_folder_e']
-data_folder_n = config['data_folder_n']
-
-# initiate client
-c = cdsapi.Client()
-
-# get data
-for year in years:
-    for variable in variables:
-
-        if "eastward" in variable:
-            folder = data_folder_e
-        elif "northward" in variable:
-            folder = data_folder_n
-
-        c.retrieve(
-            'reanalysis-era5-single-levels',
-            {
-                'product_type': 'reanalysis',
-                'format': 'netcdf',
-                'variable': variable,
-                'year': year,
-                'month': [
-                    '01', '02', '03',
-                    '04', '05', '06',
-                    '07', '08', '09',
-                    '10', '11', '12',
-                ],
-                'day': [
-                    '01', '02', '03',
-                    '04', '05', '06',
-                    '07', '08', '09',
-                    '10', '11', '12',
-                    '13', '14', '15',
-                    '16', '17', '18',
-                    '19', '20', '21',
-                    '22', '23', '24',
-                    '25', '26', '27',
-                    '28', '29', '30',
-                    '31',
-                ],
-                'time': [
-                    '00:00', '01:00', '02:00',
-                    '03:00', '04:00', '05:00',
-                    '06:00', '07:00', '08:00',
-                    '09:00', '10:00', '11:00',
-                    '12:00', '13:00', '14:00',
-                    '15:00', '16:00', '17:00',
-                    '18:00', '19:00', '20:00',
-                    '21:00', '22:00', '23:00',
-                ],
-            },
-            os.path.join(folder, f'{year}.nc'))
+# the netcdf/hdf5 libraries are not thread-safe
+nc_lock = threading.Lock()
+
+
+def month_chunks(months_per_chunk):
+    """Split the months of a year into chunks."""
+    months = list(range(1, 13))
+    return [months[i:i + months_per_chunk]
+            for i in range(0, 12, months_per_chunk)]
+
+
+def expected_hours(year, months):
+    """Number of hourly time steps of the given months of a year."""
+    return sum(pd.Timestamp(int(year), month, 1).days_in_month * 24
+               for month in months)
+
+
+def chunk_request(variable, year, months):
+    """The CDS request of one variable for the given months of a year."""
+    return {
+        'product_type': 'reanalysis',
+        'format': 'netcdf',
+        'variable': variable,
+        'year': str(year),
+        'month': [f'{month:02d}' for month in months],
+        'day': [f'{day:02d}' for day in range(1, 32)],
+        'time': [f'{hour:02d}:00' for hour in range(24)],
+    }
+
+
+def verify(path, nhours):
+    """Check that a netcdf file is readable and has <nhours> time steps."""
+
+    if not os.path.isfile(path):
+        return False
+    try:
+        with nc_lock, Dataset(path) as ds:
+            tdim = 'time' if 'time' in ds.dimensions else 'valid_time'
+            if len(ds.dimensions[tdim]) != nhours:
+                return False
+            data_vars = [v for v in ds.variables.values()
+                         if tdim in v.dimensions and v.ndim == 3]
+            if len(data_vars) != 1:
+                return False
+            # read first and last time slice
+            data_vars[0][0]
+            data_vars[0][-1]
+    except (OSError, RuntimeError, KeyError, IndexError):
+        return False
+
+    return True
+
+
+def download_chunk(get_client, variable, year, months, path, retries=5,
+                   backoff=60):
+    """Download one chunk, unless it already exists, retry with backoff."""
+
+    nhours = expected_hours(year, months)
+    if verify(path, nhours):
+        print(f'skipping {path}, already complete')
+        return path
+
+    for attempt in range(retries + 1):
+        try:
+            get_client().retrieve(
+                'reanalysis-era5-single-levels',
+                chunk_request(variable, year, months),
+                path + '.part')
+            if not verify(path + '.part', nhours):
+                raise IOError(f'{path}.part is incomplete')
+            os.replace(path + '.part', path)
+            return path
+        except Exception as e:
+            if attempt == retries:
+                raise
+            wait = backoff * 2**attempt
+            print(f'{path}: {e!r}, retrying in {wait}s')
+            time.sleep(wait)
+
+
+def merge_chunks(paths, path_out, nhours):
+    """Merge chunks into one yearly file, then delete the chunks.
+
+    The chunks are packed (int16) with different scale factors and offsets,
+    so they are decoded and the merged file is stored as float32. Only the
+    flux is stored, with the time dimension named "time" (the new CDS names
+    it "valid_time" and adds "expver" and "number"), as expected by
+    "01_regrid_ivt.py". The merge is run in a separate process (see
+    download), so it does not hold nc_lock of the download threads.
+    """
+
+    with Dataset(paths[0]) as ds:
+        tdim = 'time' if 'time' in ds.dimensions else 'valid_time'
+    ds = xr.open_mfdataset(paths, combine='nested', concat_dim=tdim,
+                           data_vars='minimal', coords='minimal',
+                           compat='override', decode_times=False,
+                           mask_and_scale=True)
+
+    # the flux only
+    var = [var for var in ds.data_vars
+           if tdim in ds[var].dims and ds[var].ndim == 3][0]
+    ds_out = ds[[var]].reset_coords(drop=True)
+    if tdim != 'time':
+        ds_out = ds_out.rename({tdim: 'time'})
+
+    # drop the packing of the first chunk
+    ds_out[var].encoding = {}
+    ds_out.to_netcdf(path_out + '.part',
+                     encoding={var: {'dtype': 'float32'}})
+    ds.close()
+    if not verify(path_out + '.part', nhours):
+        raise IOError(f'{path_out}.part is incomplete')
+    os.replace(path_out + '.part', path_out)
+    for path in paths:
+        os.remove(path)
+
+
+def client_factory(name):
+    """Thread-local client getter for a "module:attribute" client class."""
+
+    module, attr = name.split(':')
+    client_class = getattr(importlib.import_module(module), attr)
+    local = threading.local()
+
+    def get_client():
+        if not hasattr(local, 'client'):
+            local.client = client_class()
+        return local.client
+
+    return get_client
+
+
+def download(config, get_client, months_per_chunk=1, workers=4, retries=5,
+             backoff=60):
+    """Download all years and variables given in config."""
+
+    years = range(config['year_start'], config['year_end'] + 1)
+    chunks = month_chunks(months_per_chunk)
+
+    # merges run in a separate (spawned, not forked with a held nc_lock)
+    # process, not blocking the download threads
+    merger = ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+    merges = []
+
+    with merger, ThreadPoolExecutor(max_workers=workers) as executor:
+
+        # submit chunks of years not yet complete
+        pending = {}
+        futures = {}
+        for year in years:
+            for variable in variables:
+
+                if "eastward" in variable:
+                    folder = config['data_folder_e']
+                elif "northward" in variable:
+                    folder = config['data_folder_n']
+
+                path_out = os.path.join(folder, f'{year}.nc')
+                if verify(path_out, expected_hours(year, range(1, 13))):
+                    print(f'skipping {path_out}, already complete')
+                    continue
+
+                os.makedirs(os.path.join(folder, 'chunks'), exist_ok=True)
+                paths = [os.path.join(
+                    folder, 'chunks', f'{year}_{months[0]:02d}-'
+                    f'{months[-1]:02d}.nc') for months in chunks]
+                pending[path_out] = [year, paths, len(paths)]
+                for months, path in zip(chunks, paths):
+                    future = executor.submit(
+                        download_chunk, get_client, variable, year, months,
+                        path, retries, backoff)
+                    futures[future] = path_out
+
+        # merge years as soon as all their chunks are downloaded
+        for future in as_completed(futures):
+            future.result()
+            path_out = futures[future]
+            pending[path_out][2] -= 1
+            if pending[path_out][2] == 0:
+                year, paths, _ = pending.pop(path_out)
+                print(f'merging {path_out}')
+                merges.append(merger.submit(
+                    merge_chunks, paths, path_out,
+                    expected_hours(year, range(1, 13))))
+
+        for merge in merges:
+            merge.result()
+
+
+if __name__ == '__main__':
+
+    # argument parameters
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '--config', '-c',
+        type=str,
+        help='path to the config.yml file',
+        default=os.path.join(os.getcwd(), 'config.yml'),
+    )
+    parser.add_argument(
+        '--months-per-chunk', '-m',
+        type=int,
+        choices=[1, 2, 3, 4, 6, 12],
+        help='number of months per request',
+        default=1,
+    )
+    parser.add_argument(
+        '--workers', '-w',
+        type=int,
+        help='number of concurrent requests, mind the CDS queue limits',
+        default=4,
+    )
+    parser.add_argument(
+        '--retries',
+        type=int,
+        help='number of retries of a failed request',
+        default=5,
+    )
+    parser.add_argument(
+        '--backoff',
+        type=float,
+        help='seconds to wait before the first retry, doubled for each '
+             'further retry',
+        default=60,
+    )
+    parser.add_argument(
+        '--client',
+        type=str,
+        help='"module:class" of the client, any class with a '
+             'retrieve(name, request, target) method',
+        default='cdsapi:Client',
+    )
+    args = parser.parse_args()
+
+    # load config
+    config = yaml.safe_load(open(args.config))
+
+    # get data
+    download(config, client_factory(args.client),
+             months_per_chunk=args.months_per_chunk, workers=args.workers,
+             retries=args.retries, backoff=args.backoff)
@@ -10,123 +10,298 @@ import yaml
 import numpy as np
 import pandas as pd
 import xarray as xr
-import xesmf as xe
-
-# argument parameters
-parser = argparse.ArgumentParser(
-    description=__doc__,
-    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-)
-parser.add_argument(
-    'year',
-    type=str,
-    help='regrid given year',
-)
-parser.add_argument(
-    '--config', '-c',
-    type=str,
-    help='path to the config.yml file',
-    default=os.path.join(os.getcwd(), 'config.yml'),
-)
-args = parser.parse_args()
-
-# load config
-config = yaml.safe_load(open(args.config))
-
-# config parameters
-spatial_resolution = config['spatial_resolution']
-temporal_resolution = config['temporal_resolution']
-
-# filesystem
-data_folder_e = config['data_folder_e']
-data_folder_n = config['data_folder_n']
-output_folder = config['output_folder']
-os.makedirs(
-    os.path.join(output_folder, 'ivt_regridded', args.year),
-    exist_ok=True
-)
-
-# era5 files
-# name: vertical integral of eastward water vapour flux; yearly downloads
-vapfut_files = os.listdir(data_folder_e)
-# name: vertical integral of northward water vapour flux; yearly downloads
-vapfvt_files = os.listdir(data_folder_n)
-
-# output resolution
-ds_out = xr.Dataset({
-    "latitude": (["latitude"],
-                 np.arange(90, -90-spatial_resolution, -spatial_resolution)),
-    "longitude": (["longitude"],
-                  np.arange(0, 360, spatial_resolution))
-})
-
-# create file dictionary
-uflux_files = {}
-for f in vapfut_files:
-    year = f.split('_')[-1][:4]
-    uflux_files[year] = f
-
-vflux_files = {}
-for f in vapfvt_files:
-    year = f.split('_')[-1][:4]
-    vflux_files[year] = f
-
-# load uflux
-uflux_fn = uflux_files[args.year]
-ds_uflux = xr.open_dataset(os.path.join(data_folder_e, uflux_fn))
-assert len(ds_uflux.data_vars) == 1
-ds_uflux = ds_uflux.rename({list(ds_uflux.data_vars)[0]: 'uflux'})
-
-# load vflux
-vflux_fn = vflux_files[args.year]
-ds_vflux = xr.open_dataset(os.path.join(data_folder_n, vflux_fn))
-assert len(ds_vflux.data_vars) == 1
-ds_vflux = ds_vflux.rename({list(ds_vflux.data_vars)[0]: 'vflux'})
-
-# combine
-ds = ds_uflux
-ds['vflux'] = ds_vflux['vflux']
-
-# assert correct number of time-slices
-days_in_year = pd.Timestamp(int(args.year), 12, 31).day_of_year
-assert ds.time.shape[0] == days_in_year * 24
-
-# pos array
-positions = np.arange(0, ds.time.shape[0] + 24, 24)
-
-# regrid on a daily basis
-for i in range(len(positions) - 1):
-
-    print(f'{args.year}-{i+1:03d}')
-
-    # subset
-    dst = ds.isel(time=slice(positions[i], positions[i+1]))
+
+from domain import get_domain, extended_domain
+
+# regridders, kept across days and, when run by run_years.py, across years
+regridders = {}
+
+
+def get_regridder(ds_in, ds_out, weights_file):
+    """Load the bilinear regridder from <weights_file>, or create it."""
+
+    import xesmf as xe
+
+    key = (weights_file, ds_in['uflux'].shape[1:], ds_out['latitude'].size,
+           ds_out['longitude'].size)
+    if key not in regridders:
+        try:
+            regridder = xe.Regridder(
+                ds_in, ds_out, "bilinear", periodic=True,
+                reuse_weights=True,
+                filename=weights_file)
+        except OSError as e:
+            print(OSError, e)
+            regridder = xe.Regridder(ds_in, ds_out, "bilinear", periodic=True)
+            regridder.to_netcdf(weights_file)
+        regridders[key] = regridder
+
+    return regridders[key]
+
+
+def label_offset(temporal_resolution):
+    """Offset of the time labels from the start of the resampling windows
+    (the middle of the windows). The windows must divide a day.
+    """
+
+    if 24 % temporal_resolution != 0:
+        raise ValueError(f'temporal_resolution must divide 24 (hours), got '
+                         f'{temporal_resolution}')
+
+    return np.timedelta64(30 * temporal_resolution, 'm')
+
+
+def resample_ivt(dst, temporal_resolution):
+    """Average uflux, vflux and ivt over windows of <temporal_resolution>
+    hours, computing ivt from the hourly fluxes in the same pass.
+    """
+
+    offset = label_offset(temporal_resolution)
+    nt = dst.time.shape[0]
+    assert nt % temporal_resolution == 0
+    dims = dst['uflux'].dims
+    shape = (nt // temporal_resolution, temporal_resolution) + \
+        dst['uflux'].shape[1:]
+    u = dst['uflux'].values.reshape(shape)
+    v = dst['vflux'].values.reshape(shape)
+
+    # same time labels as regrid_first
+    time = dst.time.values[::temporal_resolution] + offset
+
+    return xr.Dataset(
+        {'uflux': (dims, u.mean(axis=1)),
+         'vflux': (dims, v.mean(axis=1)),
+         'ivt': (dims, np.hypot(u, v).mean(axis=1))},
+        coords={'time': time, 'latitude': dst.latitude,
+                'longitude': dst.longitude})
+
+
+def regrid_day(dst, regridder, temporal_resolution, regrid_mode):
+    """Compute ivt, regrid and resample the hourly data of one day."""
+
+    if regrid_mode == 'resample_first':
+        # regridding and the time mean are linear, so they commute
+        return regridder(resample_ivt(dst, temporal_resolution))
 
     # compute ivt
     dst['ivt'] = np.sqrt(dst['uflux']**2 + dst['vflux']**2)
 
-    # create regridder
-    try:
-        regridder = xe.Regridder(
-            dst, ds_out, "bilinear", periodic=True,
-            reuse_weights=True,
-            filename=os.path.join(output_folder,
-                                  "ivt_regridded",
-                                  "bilinear_peri.nc"))
-    except OSError as e:
-        print(OSError, e)
-        regridder = xe.Regridder(dst, ds_out, "bilinear", periodic=True)
-        regridder.to_netcdf(
-            os.path.join(output_folder, 'ivt_regridded', 'bilinear_peri.nc'))
-
     # perform regridding
     dst_r = regridder(dst)
 
-    # resample time
-    dst_rr = dst_r.resample(time=f'{temporal_resolution}h',
-                            loffset='3h',
-                            ).mean()
+    # resample time, labelled by the middle of the windows
+    dst_r = dst_r.resample(time=f'{temporal_resolution}h').mean()
+    dst_r['time'] = dst_r.time + label_offset(temporal_resolution)
+
+    return dst_r
+
+
+def open_year(year, config):
+    """Open the ERA5 uflux/vflux files of <year> as one dataset."""
+
+    data_folder_e = config['data_folder_e']
+    data_folder_n = config['data_folder_n']
+
+    # era5 files
+    # name: vertical integral of eastward water vapour flux; yearly downloads
+    vapfut_files = os.listdir(data_folder_e)
+    # name: vertical integral of northward water vapour flux; yearly downloads
+    vapfvt_files = os.listdir(data_folder_n)
+
+    # create file dictionary, skipping partial downloads and the chunks
+    # folder of 00_download_ERA5_ivt.py
+    uflux_files = {}
+    for f in vapfut_files:
+        if not (f.endswith('.nc') and
+                os.path.isfile(os.path.join(data_folder_e, f))):
+            continue
+        year_f = f.split('_')[-1][:4]
+        uflux_files[year_f] = f
+
+    vflux_files = {}
+    for f in vapfvt_files:
+        if not (f.endswith('.nc') and
+                os.path.isfile(os.path.join(data_folder_n, f))):
+            continue
+        year_f = f.split('_')[-1][:4]
+        vflux_files[year_f] = f
+
+    # load uflux
+    uflux_fn = uflux_files[year]
+    ds_uflux = xr.open_dataset(os.path.join(data_folder_e, uflux_fn))
+    assert len(ds_uflux.data_vars) == 1
+    ds_uflux = ds_uflux.rename({list(ds_uflux.data_vars)[0]: 'uflux'})
+
+    # load vflux
+    vflux_fn = vflux_files[year]
+    ds_vflux = xr.open_dataset(os.path.join(data_folder_n, vflux_fn))
+    assert len(ds_vflux.data_vars) == 1
+    ds_vflux = ds_vflux.rename({list(ds_vflux.data_vars)[0]: 'vflux'})
+
+    # combine
+    ds = ds_uflux
+    ds['vflux'] = ds_vflux['vflux']
+
+    # assert correct number of time-slices
+    days_in_year = pd.Timestamp(int(year), 12, 31).day_of_year
+    assert ds.time.shape[0] == days_in_year * 24
+
+    return ds
+
+
+def output_grid(config):
+    """The regular lat/lon grid to regrid onto, global or the domain plus
+    the margin.
+    """
+
+    lats, lons = extended_domain(config)
+
+    return xr.Dataset({
+        "latitude": (["latitude"], lats),
+        "longitude": (["longitude"], lons)
+    })
+
+
+def weights_file(config):
+    """Path of the regridding weights, one file per domain."""
+
+    domain = get_domain(config)
+    if domain is None:
+        name = 'bilinear_peri.nc'
+    else:
+        lats, lons = extended_domain(config)
+        name = (f'bilinear_peri_{lats.min():g}_{lats.max():g}_'
+                f'{lons.min():g}_{lons.max():g}.nc')
+
+    return os.path.join(config['output_folder'], 'ivt_regridded', name)
+
+
+def compare_modes(dst, regridder, temporal_resolution):
+    """Max. relative differences of uflux, vflux and ivt between both regrid
+    modes, for the hourly data <dst>.
+    """
+
+    a = regrid_day(dst.copy(), regridder, temporal_resolution, 'regrid_first')
+    b = regrid_day(dst.copy(), regridder, temporal_resolution,
+                   'resample_first')
+    assert (a.time.values == b.time.values).all()
+    rels = {}
+    for var in ['uflux', 'vflux', 'ivt']:
+        diff = float(abs(a[var] - b[var]).max())
+        rels[var] = diff / float(abs(a[var]).max())
+        print(f'{var}: max. abs. difference {diff:.3e}, '
+              f'relative {rels[var]:.3e}')
+
+    return rels
+
+
+def check_equivalence(year, config, days=1, rtol=1e-5):
+    """Compare both regrid modes on the first <days> days of <year>, raise
+    if they differ by more than <rtol>.
+    """
+
+    ds = open_year(year, config)
+    ds_out = output_grid(config)
+    regridder = get_regridder(ds, ds_out, weights_file(config))
+
+    dst = ds.isel(time=slice(0, days * 24)).load()
+    rels = compare_modes(dst, regridder, config['temporal_resolution'])
+    ds.close()
+
+    failed = [var for var, rel in rels.items() if not rel <= rtol]
+    if failed:
+        raise ValueError(f'regrid modes differ by more than {rtol:g} '
+                         f'for {failed}')
+
+
+def regrid_year(year, config):
+    """Compute ivt and regrid the ERA5 fluxes of <year>, day by day."""
+
+    # config parameters
+    temporal_resolution = config['temporal_resolution']
+    regrid_mode = config.get('regrid_mode', 'regrid_first')
+    dtype = config.get('dtype', 'float64')
+
+    # fail before regridding if the windows do not divide a day
+    label_offset(temporal_resolution)
+
+    # filesystem
+    output_folder = config['output_folder']
+    os.makedirs(
+        os.path.join(output_folder, 'ivt_regridded', year),
+        exist_ok=True
+    )
+
+    # input data and output resolution
+    ds = open_year(year, config)
+    ds_out = output_grid(config)
+
+    # pos array
+    positions = np.arange(0, ds.time.shape[0] + 24, 24)
+
+    # regrid on a daily basis
+    for i in range(len(positions) - 1):
+
+        print(f'{year}-{i+1:03d}')
+
+        # subset
+        dst = ds.isel(time=slice(positions[i], positions[i+1]))
+        dst = dst.astype(dtype)
+
+        # load regridder
+        regridder = get_regridder(dst, ds_out, weights_file(config))
+
+        # compute ivt, regrid and resample
+        dst_rr = regrid_day(dst, regridder, temporal_resolution, regrid_mode)
+        dst_rr = dst_rr.astype(dtype)
+
+        # store
+        dst_rr.to_netcdf(os.path.join(
+            output_folder, 'ivt_regridded', year, f'{i:03d}.nc'), mode='w',
+            encoding={var: {'dtype': dtype} for var in dst_rr.data_vars})
+
+    ds.close()
+
+
+if __name__ == '__main__':
+
+    # argument parameters
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        'year',
+        type=str,
+        help='regrid given year',
+    )
+    parser.add_argument(
+        '--config', '-c',
+        type=str,
+        help='path to the config.yml file',
+        default=os.path.join(os.getcwd(), 'config.yml'),
+    )
+    parser.add_argument(
+        '--check',
+        type=int,
+        metavar='DAYS',
+        help='do not regrid, but compare both regrid modes on the first '
+             'DAYS days of the given year',
+        default=None,
+    )
+    parser.add_argument(
+        '--rtol',
+        type=float,
+        help='max. relative difference of both regrid modes accepted by '
+             '--check',
+        default=1e-5,
+    )
+    args = parser.parse_args()
+
+    # load config
+    config = yaml.safe_load(open(args.config))
 
-    # store
-    dst_rr.to_netcdf(os.path.join(
-        output_folder, 'ivt_regridded', args.year, f'{i:03d}.nc'), mode='w')
+    if args.check is not None:
+        check_equivalence(args.year, config, args.check, args.rtol)
+    else:
+        regrid_year(args.year, config)
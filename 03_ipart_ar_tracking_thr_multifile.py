@@ -5,51 +5,213 @@
 
 import os
 import argparse
+from multiprocessing import Pool
 
 import yaml
+import numpy as np
+from netCDF4 import Dataset
 from ipart import thr
+from ipart.utils import funcs
 
-# argument parameters
-parser = argparse.ArgumentParser(
-    description=__doc__,
-    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-)
-parser.add_argument(
-    '--config', '-c',
-    type=str,
-    help='path to the config.yml file',
-    default=os.path.join(os.getcwd(), 'config.yml'),
-)
-args = parser.parse_args()
-
-# load config
-config = yaml.safe_load(open(args.config))
-
-# parameters
-years = range(config['year_start'], config['year_end'] + 1)
-kernel = config['kernel']
-shift_lon = config['shift_lon']
-
-# filesystem
-output_folder = config['output_folder']
-os.makedirs(os.path.join(output_folder, 'ipart', 'thr'), exist_ok=True)
-if config['do_regridding']:
-    input_ivt_folder = 'ivt_regridded/'
-else:
-    input_ivt_folder = 'ivt/'
-
-# create file list
-filelist = []
-for year in years:
-    file_in_name = f'{year:d}.nc'
-    abpath_in = os.path.join(output_folder, input_ivt_folder, file_in_name)
-    filelist.append(abpath_in)
-print(filelist)
-
-# need at least two years of data
-assert len(filelist) >= 2
-
-# compute
-thr.rotatingTHR(filelist, 'ivt', kernel,
-                os.path.join(output_folder, 'ipart', 'thr'),
-                shift_lon=shift_lon)
+from domain import get_domain, is_cyclic, crop
+
+
+def read_time_slice(abpath_in, varid, i0, i1):
+    """Read time steps [i0, i1) of a variable as NCVAR, like funcs.readNC."""
+
+    fin = Dataset(abpath_in, 'r')
+    var = fin.variables[varid]
+
+    # axes
+    axislist = []
+    for dd in var.dimensions:
+        ncaxis = fin.variables[dd]
+        if dd == 'time':
+            axisii = funcs.num2dateWrapper(ncaxis[i0:i1], ncaxis.units)
+        else:
+            axisii = ncaxis[:]
+        axisattr = funcs.getAttributes(ncaxis)
+        axisattr['isunlimited'] = fin.dimensions[dd].isunlimited()
+        axislist.append(funcs.NCVAR(axisii, dd, [], axisattr))
+
+    # data
+    assert var.dimensions[0] == 'time'
+    ncvarNV = funcs.NCVAR(var[i0:i1], varid, axislist,
+                          funcs.getAttributes(var))
+    for ii in axislist:
+        setattr(ncvarNV, ii.id, ii)
+    fin.close()
+
+    return funcs.increasingLatitude(
+        ncvarNV, funcs.interpretAxis('latitude', ncvarNV))
+
+
+def mask_steps(varNV, i0, i1):
+    """Set time steps [i0, i1) to 0 and mask them, as rotatingTHR does at the
+    outer ends of the first and last year.
+    """
+    varNV.data = np.ma.masked_array(varNV.data)
+    varNV.data[i0:i1] = 0
+    varNV.data[i0:i1] = np.ma.masked
+
+
+def crop_thr_file(abpath, domain):
+    """Crop the THR output stored in <abpath> to the domain, in place."""
+
+    # funcs.readNC leaves the file open, write to a new file
+    varsNV = [crop(funcs.readNC(abpath, varid), domain)
+              for varid in ['ivt', 'ivt_rec', 'ivt_ano']]
+    abpath_tmp = abpath + '.tmp'
+    funcs.saveNC(abpath_tmp, varsNV[0], 'w')
+    for varNV in varsNV[1:]:
+        funcs.saveNC(abpath_tmp, varNV, 'a')
+    os.replace(abpath_tmp, abpath)
+
+
+def thr_year(year, config):
+    """Compute the THR of <year>, padded by halo time steps read from the
+    files of the adjacent years.
+    """
+
+    # parameters
+    year = int(year)
+    years = range(config['year_start'], config['year_end'] + 1)
+    kernel = config['kernel']
+    shift_lon = config['shift_lon']
+    dtype = config.get('dtype', 'float64')
+    domain = get_domain(config)
+    dt = kernel[0]
+    halo = max(config.get('thr_halo', 4 * dt), dt)
+
+    # filesystem
+    output_folder = config['output_folder']
+    os.makedirs(os.path.join(output_folder, 'ipart', 'thr'), exist_ok=True)
+    if config['do_regridding']:
+        input_ivt_folder = 'ivt_regridded/'
+    else:
+        input_ivt_folder = 'ivt/'
+
+    def ivt_file(year):
+        return os.path.join(output_folder, input_ivt_folder, f'{year:d}.nc')
+
+    # the year, and the halo time steps of the adjacent years
+    has_prev = year - 1 in years
+    has_next = year + 1 in years
+    varNV = funcs.readNC(ivt_file(year), 'ivt')
+    parts = [varNV]
+    if has_prev:
+        with Dataset(ivt_file(year - 1)) as f:
+            nt = len(f.dimensions['time'])
+        parts.insert(0, read_time_slice(
+            ivt_file(year - 1), 'ivt', max(nt - halo, 0), nt))
+    if has_next:
+        parts.append(read_time_slice(ivt_file(year + 1), 'ivt', 0, halo))
+    n0 = len(parts[0].getTime()) if has_prev else 0
+    n1 = n0 + len(varNV.getTime())
+
+    var = parts[0]
+    for part in parts[1:]:
+        var = funcs.cat(var, part, axis=0)
+    if is_cyclic(domain):
+        var = var.shiftLon(shift_lon)
+    var.data = var.data.astype(dtype, copy=False)
+
+    # compute
+    var, rec, ano = thr.THR(var, kernel)
+
+    # crop the halo, and the margin around the domain
+    var = crop(var.sliceIndex(n0, n1), domain)
+    rec = crop(rec.sliceIndex(n0, n1), domain)
+    ano = crop(ano.sliceIndex(n0, n1), domain)
+
+    # no data to pad the kernel at the ends of the first/last year
+    if not has_prev:
+        mask_steps(rec, 0, dt)
+        mask_steps(ano, 0, dt)
+    if not has_next:
+        mask_steps(rec, -dt, None)
+        mask_steps(ano, -dt, None)
+
+    # save
+    abpath_out = os.path.join(
+        output_folder, 'ipart', 'thr',
+        f'{year}-THR-kernel-t{kernel[0]}-s{kernel[1]}.nc')
+    print(f'saving output to {abpath_out}')
+    funcs.saveNC(abpath_out, var, 'w', dtype=dtype)
+    funcs.saveNC(abpath_out, rec, 'a', dtype=dtype)
+    funcs.saveNC(abpath_out, ano, 'a', dtype=dtype)
+
+
+if __name__ == '__main__':
+
+    # argument parameters
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '--config', '-c',
+        type=str,
+        help='path to the config.yml file',
+        default=os.path.join(os.getcwd(), 'config.yml'),
+    )
+    parser.add_argument(
+        '--parallel',
+        action='store_true',
+        help='compute the years independently, padded by "thr_halo" time '
+             'steps of the adjacent years, instead of with rotatingTHR',
+    )
+    parser.add_argument(
+        '--workers', '-w',
+        type=int,
+        help='number of years computed in parallel (with --parallel)',
+        default=os.cpu_count(),
+    )
+    args = parser.parse_args()
+
+    # load config
+    config = yaml.safe_load(open(args.config))
+
+    # parameters
+    years = range(config['year_start'], config['year_end'] + 1)
+    kernel = config['kernel']
+    shift_lon = config['shift_lon']
+    domain = get_domain(config)
+
+    # filesystem
+    output_folder = config['output_folder']
+    os.makedirs(os.path.join(output_folder, 'ipart', 'thr'), exist_ok=True)
+    if config['do_regridding']:
+        input_ivt_folder = 'ivt_regridded/'
+    else:
+        input_ivt_folder = 'ivt/'
+
+    # create file list
+    filelist = []
+    for year in years:
+        file_in_name = f'{year:d}.nc'
+        abpath_in = os.path.join(output_folder, input_ivt_folder, file_in_name)
+        filelist.append(abpath_in)
+    print(filelist)
+
+    # need at least two years of data
+    assert len(filelist) >= 2
+
+    # compute
+    if args.parallel:
+        with Pool(min(args.workers, len(filelist))) as pool:
+            pool.starmap(thr_year, [(year, config) for year in years],
+                         chunksize=1)
+    else:
+        # no shift of the longitudes of a regional domain
+        thr.rotatingTHR(filelist, 'ivt', kernel,
+                        os.path.join(output_folder, 'ipart', 'thr'),
+                        shift_lon=shift_lon if is_cyclic(domain) else None)
+
+        # crop the margin around the domain
+        if domain is not None:
+            for year in years:
+                crop_thr_file(os.path.join(
+                    output_folder, 'ipart', 'thr',
+                    f'{year}-THR-kernel-t{kernel[0]}-s{kernel[1]}.nc'),
+                    domain)
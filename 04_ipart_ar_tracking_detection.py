@@ -6,149 +6,392 @@
 import os
 import sys
 import argparse
+import itertools
 
 import yaml
 import numpy as np
+import pandas as pd
 from netCDF4 import Dataset
 from ipart.utils import funcs
-from ipart.AR_detector import findARsGen
-
-# argument parameters
-parser = argparse.ArgumentParser(
-    description=__doc__,
-    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-)
-parser.add_argument(
-    'year',
-    type=str,
-    help='detect for given year',
-)
-parser.add_argument(
-    '--config', '-c',
-    type=str,
-    help='path to the config.yml file',
-    default=os.path.join(os.getcwd(), 'config.yml'),
-)
-args = parser.parse_args()
-
-# load config
-config = yaml.safe_load(open(args.config))
-
-# parameters
-year = args.year
-shift_lon = config['shift_lon']  # shift to center Pacific and Altantic
-param_dict = {
-    # kg/m/s, define AR candidates as regions >= than this anomalous ivt.
-    # If None is given, compute a threshold based on anomalous ivt data. See
-    # the docstring of ipart.AR_detector.determineThresLow() for details.
-    'thres_low': config['thres_low'],
-    # km^2, drop AR candidates smaller than this area.
-    'min_area': config['min_area'],
-    # km^2, drop AR candidates larger than this area.
-    'max_area': config['max_area'],
-    # float, min length/width ratio.
-    'min_LW': config['min_LW'],
-    # degree, exclude systems whose centroids are lower than this latitude.
-    # NOTE this is the absolute latitude for both NH and SH. For SH, systems
-    # with centroid latitude north of -20 will be excluded.
-    'min_lat': config['min_lat'],
-    # degree, exclude systems whose centroids are higher than this latitude.
-    # NOTE this is the absolute latitude for both NH and SH. For SH, systems
-    # with centroid latitude south of -80 will be excluded.
-    'max_lat': config['max_lat'],
-    # km, ARs shorter than this length is treated as relaxed.
-    'min_length': config['min_length'],
-    # km, ARs shorter than this length is discarded.
-    'min_length_hard': config['min_length_hard'],
-    # degree lat/lon, error when simplifying axis using rdp algorithm.
-    'rdp_thres': config['rdp_thres'],
-    # grids. Remove small holes in AR contour.
-    'fill_radius': config['fill_radius'],
-    # do peak partition or not, used to separate systems that are merged
-    # together with an outer contour.
-    'single_dome': config['single_dome'],
-    # max prominence/height ratio of a local peak. Only used when
-    # single_dome=True
-    'max_ph_ratio': config['max_ph_ratio'],
-    # minimal proportion of flux component in a direction to total flux to
-    # allow edge building in that direction
-    'edge_eps': config['edge_eps'],
-    # bool, if True, treat the data as zonally cyclic (e.g. entire hemisphere
-    # or global). ARs covering regions across the longitude bounds will be
-    # correctly treated as one. If your data is not zonally cyclic, or a zonal
-    # shift of the data can put the domain of interest to the center, consider
-    # doing the shift and setting this to False, as it will save computations.
-    'zonal_cyclic': config['zonal_cyclic'],
-}
-
-# filesystem
-data_folder_e = config['data_folder_e']
-data_folder_n = config['data_folder_n']
-output_folder = config['output_folder']
-os.makedirs(os.path.join(output_folder, 'ipart', 'ar'), exist_ok=True)
-label_file_out_name = f'{year}_labels_angles_ivt.nc'
-record_file_out_name = f'{year}_ar_records.csv'
-
-# load flux data
-if config['do_regridding']:
-    quNV = funcs.readNC(
-        os.path.join(output_folder, 'ivt_regridded', f'{year}.nc'), 'uflux')
-    qvNV = funcs.readNC(
-        os.path.join(output_folder, 'ivt_regridded', f'{year}.nc'), 'vflux')
-else:
-    quNV = funcs.readNC(
-        os.path.join(data_folder_e, f'{year}.nc'), 'uflux')
-    qvNV = funcs.readNC(
-        os.path.join(data_folder_n, f'{year}.nc'), 'vflux')
-
-# shift flux data
-quNV = quNV.shiftLon(shift_lon)
-qvNV = qvNV.shiftLon(shift_lon)
-
-# load ivt/thr data (already shifted)
-t, s = config['kernel'][:2]
-ivtNV = funcs.readNC(os.path.join(
-    output_folder, 'ipart', 'thr', f'{year}-THR-kernel-t{t}-s{s}.nc'),
-    'ivt')
-ivtrecNV = funcs.readNC(os.path.join(
-    output_folder, 'ipart', 'thr', f'{year}-THR-kernel-t{t}-s{s}.nc'),
-    'ivt_rec')
-ivtanoNV = funcs.readNC(os.path.join(
-    output_folder, 'ipart', 'thr', f'{year}-THR-kernel-t{t}-s{s}.nc'),
-    'ivt_ano')
-
-# get coordinates
-latax = quNV.getLatitude()
-lonax = quNV.getLongitude()
-timeax = ivtNV.getTime()
-
-# nc file to save AR location labels
-ncfout = Dataset(os.path.join(
-    output_folder, 'ipart', 'ar', label_file_out_name), 'w')
-
-# csv file to save AR record table
-# remove summarization in csv file
-np.set_printoptions(threshold=sys.maxsize)
-
-with open(os.path.join(
-        output_folder, 'ipart', 'ar', record_file_out_name), 'w') as dfout:
-
-    finder_gen = findARsGen(ivtNV.data, ivtrecNV.data, ivtanoNV.data,
-                            quNV.data, qvNV.data, latax, lonax, times=timeax,
-                            **param_dict)
-    # create metadata
-    next(finder_gen)
-
-    for (tidx, timett, label, angle, cross, result_df) in finder_gen:
-
-        # store ar records
-        result_df.to_csv(dfout, header=dfout.tell() == 0, index=False)
-
-        # store labels, angles, ivt
-        funcs.saveNCDims(ncfout, label.axislist)
-        funcs._saveNCVAR(ncfout, label, 'int')
-        funcs._saveNCVAR(ncfout, angle)
-        funcs._saveNCVAR(ncfout, cross)
-
-# close .nc file
-ncfout.close()
+from ipart.AR_detector import (findARsGen, prepareMeta, _findARs,
+                               findARAxis, uvDecomp, getARData)
+
+from domain import get_domain, is_cyclic, crop
+from track_masks import bbox_columns, label_bboxes
+
+# parameters the stages of the detection depend on, used in the sweep mode
+# to share the labelling, axis finding and AR data between parameter sets
+label_params = ['thres_low', 'min_area', 'max_area', 'min_lat', 'max_lat',
+                'single_dome', 'max_ph_ratio', 'fill_radius', 'zonal_cyclic']
+axis_params = ['edge_eps']
+data_params = ['rdp_thres']
+
+
+def get_param_dict(config):
+    """The detection parameters given in config."""
+
+    return {
+        # kg/m/s, define AR candidates as regions >= than this anomalous
+        # ivt. If None is given, compute a threshold based on anomalous ivt
+        # data. See the docstring of ipart.AR_detector.determineThresLow()
+        # for details.
+        'thres_low': config['thres_low'],
+        # km^2, drop AR candidates smaller than this area.
+        'min_area': config['min_area'],
+        # km^2, drop AR candidates larger than this area.
+        'max_area': config['max_area'],
+        # float, min length/width ratio.
+        'min_LW': config['min_LW'],
+        # degree, exclude systems whose centroids are lower than this
+        # latitude. NOTE this is the absolute latitude for both NH and SH.
+        # For SH, systems with centroid latitude north of -20 will be
+        # excluded.
+        'min_lat': config['min_lat'],
+        # degree, exclude systems whose centroids are higher than this
+        # latitude. NOTE this is the absolute latitude for both NH and SH.
+        # For SH, systems with centroid latitude south of -80 will be
+        # excluded.
+        'max_lat': config['max_lat'],
+        # km, ARs shorter than this length is treated as relaxed.
+        'min_length': config['min_length'],
+        # km, ARs shorter than this length is discarded.
+        'min_length_hard': config['min_length_hard'],
+        # degree lat/lon, error when simplifying axis using rdp algorithm.
+        'rdp_thres': config['rdp_thres'],
+        # grids. Remove small holes in AR contour.
+        'fill_radius': config['fill_radius'],
+        # do peak partition or not, used to separate systems that are merged
+        # together with an outer contour.
+        'single_dome': config['single_dome'],
+        # max prominence/height ratio of a local peak. Only used when
+        # single_dome=True
+        'max_ph_ratio': config['max_ph_ratio'],
+        # minimal proportion of flux component in a direction to total flux
+        # to allow edge building in that direction
+        'edge_eps': config['edge_eps'],
+        # bool, if True, treat the data as zonally cyclic (e.g. entire
+        # hemisphere or global). ARs covering regions across the longitude
+        # bounds will be correctly treated as one. If your data is not zonally
+        # cyclic, or a zonal shift of the data can put the domain of interest
+        # to the center, consider doing the shift and setting this to False,
+        # as it will save computations. Always False for a regional domain.
+        'zonal_cyclic': config['zonal_cyclic'] and
+        is_cyclic(get_domain(config)),
+    }
+
+
+def load_fields(year, config):
+    """Load the fluxes and the THR output of <year>, as NCVARs."""
+
+    # parameters
+    shift_lon = config['shift_lon']  # shift to center Pacific and Altantic
+
+    # filesystem
+    data_folder_e = config['data_folder_e']
+    data_folder_n = config['data_folder_n']
+    output_folder = config['output_folder']
+
+    # load flux data
+    if config['do_regridding']:
+        quNV = funcs.readNC(os.path.join(
+            output_folder, 'ivt_regridded', f'{year}.nc'), 'uflux')
+        qvNV = funcs.readNC(os.path.join(
+            output_folder, 'ivt_regridded', f'{year}.nc'), 'vflux')
+    else:
+        quNV = funcs.readNC(
+            os.path.join(data_folder_e, f'{year}.nc'), 'uflux')
+        qvNV = funcs.readNC(
+            os.path.join(data_folder_n, f'{year}.nc'), 'vflux')
+
+    # shift flux data, crop to the domain
+    domain = get_domain(config)
+    if is_cyclic(domain):
+        quNV = quNV.shiftLon(shift_lon)
+        qvNV = qvNV.shiftLon(shift_lon)
+    quNV = crop(quNV, domain)
+    qvNV = crop(qvNV, domain)
+
+    # load ivt/thr data (already shifted and cropped)
+    t, s = config['kernel'][:2]
+    ivtNV = funcs.readNC(os.path.join(
+        output_folder, 'ipart', 'thr', f'{year}-THR-kernel-t{t}-s{s}.nc'),
+        'ivt')
+    ivtrecNV = funcs.readNC(os.path.join(
+        output_folder, 'ipart', 'thr', f'{year}-THR-kernel-t{t}-s{s}.nc'),
+        'ivt_rec')
+    ivtanoNV = funcs.readNC(os.path.join(
+        output_folder, 'ipart', 'thr', f'{year}-THR-kernel-t{t}-s{s}.nc'),
+        'ivt_ano')
+
+    # keep fields in the configured precision
+    dtype = config.get('dtype', 'float64')
+    for ncvar in [quNV, qvNV, ivtNV, ivtrecNV, ivtanoNV]:
+        ncvar.data = ncvar.data.astype(dtype, copy=False)
+
+    return quNV, qvNV, ivtNV, ivtrecNV, ivtanoNV
+
+
+def detect_year(year, config):
+    """Detect ARs of <year> from the THR output."""
+
+    # parameters
+    param_dict = get_param_dict(config)
+
+    # filesystem
+    output_folder = config['output_folder']
+    os.makedirs(os.path.join(output_folder, 'ipart', 'ar'), exist_ok=True)
+    label_file_out_name = f'{year}_labels_angles_ivt.nc'
+    record_file_out_name = f'{year}_ar_records.csv'
+    bbox_file_out_name = f'{year}_label_bbox.pkl'
+
+    # load data
+    quNV, qvNV, ivtNV, ivtrecNV, ivtanoNV = load_fields(year, config)
+
+    # get coordinates
+    latax = quNV.getLatitude()
+    lonax = quNV.getLongitude()
+    timeax = ivtNV.getTime()
+
+    # nc file to save AR location labels
+    ncfout = Dataset(os.path.join(
+        output_folder, 'ipart', 'ar', label_file_out_name), 'w')
+
+    # csv file to save AR record table
+    # remove summarization in csv file
+    np.set_printoptions(threshold=sys.maxsize)
+
+    with open(os.path.join(output_folder, 'ipart', 'ar',
+                           record_file_out_name), 'w') as dfout:
+
+        finder_gen = findARsGen(ivtNV.data, ivtrecNV.data, ivtanoNV.data,
+                                quNV.data, qvNV.data, latax, lonax,
+                                times=timeax, **param_dict)
+        # create metadata
+        next(finder_gen)
+
+        # bounding boxes of the labels, (time, id) -> (y0, y1, x0, x1)
+        bboxes = []
+
+        for lidx, (tidx, timett, label, angle, cross, result_df) in \
+                enumerate(finder_gen):
+
+            # store ar records, and index the bounding boxes of the labels
+            # (candidates may all be filtered out, e.g. in a small domain)
+            if len(result_df) > 0:
+                result_df.to_csv(dfout, header=dfout.tell() == 0,
+                                 index=False)
+                ids = result_df['id'].astype(int).values
+                for i, bbox in zip(ids, label_bboxes(
+                        label.data[0], ids, param_dict['zonal_cyclic'])):
+                    bboxes.append(
+                        (pd.Timestamp(timett), i, tidx, lidx) + bbox)
+
+            # store labels, angles, ivt
+            funcs.saveNCDims(ncfout, label.axislist)
+            funcs._saveNCVAR(ncfout, label, 'int')
+            funcs._saveNCVAR(ncfout, angle)
+            funcs._saveNCVAR(ncfout, cross)
+
+    # close .nc file
+    ncfout.close()
+
+    # store bounding box index
+    pd.DataFrame(bboxes, columns=bbox_columns).to_pickle(os.path.join(
+        output_folder, 'ipart', 'ar', bbox_file_out_name))
+
+
+def parameter_sets(config):
+    """All combinations of the parameter values given in config['sweep'],
+    as a dict of parameter set name: param_dict.
+    """
+
+    base = get_param_dict(config)
+    sweep = config['sweep']
+    names = list(sweep)
+    values = [v if isinstance(v, list) else [v] for v in sweep.values()]
+    unknown = set(names) - set(base)
+    if unknown:
+        raise ValueError(f'unknown detection parameters: {unknown}')
+
+    sets = {}
+    for i, combination in enumerate(itertools.product(*values)):
+        param_dict = dict(base)
+        param_dict.update(zip(names, combination))
+        sets[f'set{i:03d}'] = param_dict
+
+    return sets
+
+
+def group_sets(sets, keys):
+    """Group parameter sets by their values of the parameters <keys>."""
+
+    groups = {}
+    for name, param_dict in sets.items():
+        key = tuple(param_dict[k] for k in keys)
+        groups.setdefault(key, {})[name] = param_dict
+
+    return list(groups.values())
+
+
+def filter_records(ardf, param_dict):
+    """Apply the filters of getARData to records found without filtering."""
+
+    area = ardf['area'].astype(float)
+    length = ardf['length'].astype(float)
+    lw = ardf['LW_ratio'].astype(float)
+    keep = (area >= param_dict['min_area']) & \
+        (length >= param_dict['min_length_hard']) & \
+        ~((lw < param_dict['min_LW']) & (length < param_dict['min_length']))
+    is_relaxed = (length < param_dict['min_length']) | \
+        (np.sign(ardf['centroid_y'].astype(float)) *
+         ardf['qv_mean'].astype(float) <= 0)
+
+    ardf = ardf.loc[keep].copy()
+    ardf['is_relaxed'] = is_relaxed.loc[keep]
+
+    return ardf
+
+
+def sweep_year(year, config):
+    """Detect ARs of <year> for all parameter sets of the sweep.
+
+    The fields are loaded once. For each time step, the labelling is done
+    once per combination of the parameters in <label_params>, the axes once
+    per combination of <label_params> and <axis_params>, and the AR data
+    once per combination of <label_params>, <axis_params> and
+    <data_params>, without the record filters of getARData. These filters
+    are then applied per parameter set.
+    """
+
+    # parameter sets, grouped by the stages they share
+    sets = parameter_sets(config)
+    no_filter = {'min_area': 0, 'min_length_hard': 0, 'min_LW': 0,
+                 'min_length': 0}
+
+    # filesystem
+    output_folder = config['output_folder']
+    sweep_folder = os.path.join(output_folder, 'ipart', 'ar_sweep')
+    for name in sets:
+        os.makedirs(os.path.join(sweep_folder, name), exist_ok=True)
+    pd.DataFrame.from_dict(sets, orient='index').to_csv(
+        os.path.join(sweep_folder, 'parameter_sets.csv'))
+
+    # load data
+    quNV, qvNV, ivtNV, ivtrecNV, ivtanoNV = load_fields(year, config)
+    ivt = funcs.squeezeTo3D(ivtNV.data)
+    ivtrec = funcs.squeezeTo3D(ivtrecNV.data)
+    ivtano = funcs.squeezeTo3D(ivtanoNV.data)
+    qu = funcs.squeezeTo3D(quNV.data)
+    qv = funcs.squeezeTo3D(qvNV.data)
+
+    # NOTE: important to make sure lat is increasing (as in findARsGen)
+    lats = quNV.getLatitude()
+    ivt, _ = funcs.increasingLatitude2(ivt, 1, lats)
+    ivtrec, _ = funcs.increasingLatitude2(ivtrec, 1, lats)
+    ivtano, _ = funcs.increasingLatitude2(ivtano, 1, lats)
+    qu, _ = funcs.increasingLatitude2(qu, 1, lats)
+    qv, lats = funcs.increasingLatitude2(qv, 1, lats)
+    timeax, areamap, costhetas, sinthetas, lats, lons, reso = prepareMeta(
+        lats, quNV.getLongitude(), ivtNV.getTime(), ivt.shape[0],
+        ivt.shape[1], ivt.shape[2], verbose=False)
+    for param_dict in sets.values():
+        if param_dict['fill_radius'] is None:
+            param_dict['fill_radius'] = max(1, int(4*0.75/reso))
+
+    # csv files to save AR record tables
+    # remove summarization in csv file
+    np.set_printoptions(threshold=sys.maxsize)
+    dfouts = {name: open(os.path.join(sweep_folder, name,
+                                      f'{year}_ar_records.csv'), 'w')
+              for name in sets}
+
+    for ii, timett in enumerate(timeax):
+
+        timett_str = '%d-%02d-%02d %02d:00' % (
+            timett.year, timett.month, timett.day, timett.hour)
+        print(f'{year}: {timett_str}')
+
+        slab = ivt[ii]
+        slabano = ivtano[ii]
+        slabrec = ivtrec[ii]
+        quslab = qu[ii]
+        qvslab = qv[ii]
+        quano = qvano = None
+
+        for lsets in group_sets(sets, label_params):
+
+            # find ARs
+            param_dict = next(iter(lsets.values()))
+            mask_list, armask = _findARs(slabano, lats, areamap, param_dict)
+            if armask.sum() == 0:
+                continue
+
+            # decompose background-transient, once per time step
+            if quano is None:
+                _, quano, _, qvano = uvDecomp(quslab, qvslab, slabrec,
+                                              slabano)
+
+            for asets in group_sets(lsets, axis_params):
+
+                # find AR axis
+                param_dict = next(iter(asets.values()))
+                axis_list, _ = findARAxis(quslab, qvslab, mask_list,
+                                          costhetas, sinthetas, param_dict)
+
+                for dsets in group_sets(asets, data_params):
+
+                    # fetch AR related data, without filtering
+                    param_dict = dict(next(iter(dsets.values())),
+                                      **no_filter)
+                    ardf = getARData(
+                        slab, quslab, qvslab, slabano, quano, qvano,
+                        areamap, lats, lons, mask_list, axis_list,
+                        timett_str, param_dict)[3]
+                    if len(ardf) == 0:
+                        continue
+
+                    # filter and store ar records of each parameter set
+                    for name, param_dict in dsets.items():
+                        result_df = filter_records(ardf, param_dict)
+                        dfout = dfouts[name]
+                        result_df.to_csv(dfout, header=dfout.tell() == 0,
+                                         index=False)
+
+    for dfout in dfouts.values():
+        dfout.close()
+
+
+if __name__ == '__main__':
+
+    # argument parameters
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        'year',
+        type=str,
+        help='detect for given year',
+    )
+    parser.add_argument(
+        '--config', '-c',
+        type=str,
+        help='path to the config.yml file',
+        default=os.path.join(os.getcwd(), 'config.yml'),
+    )
+    parser.add_argument(
+        '--sweep',
+        action='store_true',
+        help='detect ARs for all combinations of the parameter values given '
+             'in the "sweep" section of config.yml, write the records of '
+             'each parameter set to ipart/ar_sweep/',
+    )
+    args = parser.parse_args()
+
+    # load config
+    config = yaml.safe_load(open(args.config))
+
+    if args.sweep:
+        sweep_year(args.year, config)
+    else:
+        detect_year(args.year, config)
@@ -6,86 +6,297 @@
 import os
 import sys
 import argparse
+from multiprocessing import Pool
 
 import yaml
 import numpy as np
 import pandas as pd
-from ipart.AR_tracer import readCSVRecord, trackARs, filterTracks
-
-# argument parameters
-parser = argparse.ArgumentParser(
-    description=__doc__,
-    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-)
-parser.add_argument(
-    '--config', '-c',
-    type=str,
-    help='path to the config.yml file',
-    default=os.path.join(os.getcwd(), 'config.yml'),
-)
-args = parser.parse_args()
-
-# load config
-config = yaml.safe_load(open(args.config))
-
-# parameters
-# Int, hours, gap allowed to link 2 records. Should be the time resolution of
-# the data.
-TIME_GAP_ALLOW = config['TIME_GAP_ALLOW']
-# tracking scheme. 'simple': all tracks are simple paths.
-# 'full': use the network scheme, tracks are connected by their joint points.
-TRACK_SCHEME = config['TRACK_SCHEME']  # 'simple' | 'full'
-# int, max Hausdorff distance in km to define a neighborhood relationship
-MAX_DIST_ALLOW = config['MAX_DIST_ALLOW']  # km
-# int, min duration in hrs to keep a track.
-MIN_DURATION = config['MIN_DURATION']
-# int, min number of non-relaxed records in a track to keep a track.
-MIN_NONRELAX = config['MIN_NONRELAX']
-
-# filesystem
-output_folder = config['output_folder']
-
-# combine csv files
-if not os.path.isfile(os.path.join(
-        output_folder, 'ipart', 'ar', 'ar_records.csv')):
-    os.system(
-        "awk '(NR == 1) || (FNR > 1)' "
-        f"{os.path.join(output_folder, 'ipart', 'ar', '*.csv')}"
-        f" > "
-        f"{os.path.join(output_folder, 'ipart', 'ar', 'ar_records.csv')}"
+from ipart.AR_tracer import (AR, readCSVRecord, trackARs, filterTracks,
+                             matchCenters)
+
+
+def track_step(track_list, finished_list, recii, tnow, time_gap_allow,
+               max_dist_allow, last=False):
+    """Allocate the records <recii> at time <tnow> to the tracks of
+    <track_list> (in place), exactly like one time step of trackARs with the
+    'simple' scheme. <last> marks the last time step of the whole record.
+    """
+
+    _time_gap_allow = pd.Timedelta(hours=time_gap_allow)
+
+    # create new ars when 1st record is read
+    if len(track_list) == 0:
+        # trackARs does not keep tracks created at the last time step
+        if not last:
+            for jj in range(recii.shape[0]):
+                track_list.append(AR(AR.total_count, recii.iloc[[jj]]))
+        return
+
+    # end existing ars if gap too long (removing while iterating, as
+    # trackARs does)
+    for trjj in track_list:
+        if tnow - trjj.latest.time > _time_gap_allow:
+            trjj.finish = True
+            finished_list.append(trjj)
+            track_list.remove(trjj)
+
+    if len(track_list) == 0:
+        return
+
+    # link tracks
+    all_rec_id = recii.id.tolist()
+    track_list[:], allocated_recs = matchCenters(
+        track_list, recii, time_gap_allow, max_dist_allow,
+        track_scheme='simple', verbose=False)
+
+    # create a new ar for left-overs
+    for jj in set(all_rec_id).difference(allocated_recs):
+        track_list.append(AR(AR.total_count, recii[recii.id == jj]))
+
+
+def state(track_list):
+    """(time, id) of the latest records of the tracks of <track_list>, in
+    the order of the list (which decides the order of finished tracks).
+    """
+    return tuple((tr.latest.time, tr.latest.id) for tr in track_list)
+
+
+def track_segment(record, time_gap_allow, max_dist_allow, last=False):
+    """Track the records of one time segment, starting without tracks.
+
+    Returns the data of the finished and unfinished tracks, and the state of
+    the track list after each time step. With <last>, the segment is the last
+    one of the record.
+    """
+
+    timelist = pd.DatetimeIndex(record['time'].unique()).sort_values()
+    track_list = []
+    finished_list = []
+    states = {}
+    for ii, tnow in enumerate(timelist):
+        recii = record[record.time == tnow]
+        track_step(track_list, finished_list, recii, tnow, time_gap_allow,
+                   max_dist_allow, last=last and ii == len(timelist) - 1)
+        states[tnow] = state(track_list)
+
+    return ([tr.data for tr in finished_list],
+            [tr.data for tr in track_list]), states
+
+
+def stitch(tracks, segment, states, record, time_gap_allow, max_dist_allow,
+           last=False):
+    """Continue the tracks of the previous segments into the next segment.
+
+    <tracks> are the (finished, unfinished) tracks up to the start of the
+    segment. The records of the segment are re-tracked time step by time
+    step, continuing <tracks>, until the track list is in the same state
+    (same tracks, in the same order) as in the independent tracking of the
+    segment (<segment>, <states>, as returned by track_segment). From then
+    on, both link and finish tracks the same way, so the remaining records
+    of the segment's tracks are appended to the re-tracked ones, keeping the
+    order of the segment's lists. Returns the (finished, unfinished) tracks
+    up to the end of the segment.
+    """
+
+    timelist = pd.DatetimeIndex(record['time'].unique()).sort_values()
+    finished_list = [AR(AR.total_count, data) for data in tracks[0]]
+    track_list = [AR(AR.total_count, data) for data in tracks[1]]
+
+    # re-track until the state agrees with the segment's tracking
+    converged = None
+    for ii, tnow in enumerate(timelist):
+        recii = record[record.time == tnow]
+        track_step(track_list, finished_list, recii, tnow, time_gap_allow,
+                   max_dist_allow, last=last and ii == len(timelist) - 1)
+        if state(track_list) == states[tnow]:
+            converged = tnow
+            break
+    print(f'# stitched segment starting at {timelist[0]}, '
+          f'converged at {converged}')
+
+    if converged is None:
+        return ([tr.data for tr in finished_list],
+                [tr.data for tr in track_list])
+
+    # the segment's tracks after convergence
+    continued = {(tr.latest.time, tr.latest.id): tr for tr in track_list}
+
+    def splice(data):
+        before = data.loc[data['time'] <= converged]
+        if len(before) == 0:
+            # started after convergence
+            return data
+        key = (before['time'].iloc[-1], before['id'].iloc[-1])
+        if key not in continued:
+            # finished before convergence, already re-tracked
+            return None
+        tr = continued[key]
+        tr.append(data.loc[data['time'] > converged])
+        return tr.data
+
+    finished = [tr.data for tr in finished_list]
+    unfinished = []
+    for data in segment[0]:
+        data = splice(data)
+        if data is not None:
+            finished.append(data)
+    for data in segment[1]:
+        data = splice(data)
+        if data is not None:
+            unfinished.append(data)
+
+    return finished, unfinished
+
+
+def track_segmented(ardf, config, segment_years=1, workers=1):
+    """Track the records in time segments of <segment_years> years in
+    parallel, then stitch the segments. The tracks, and their order, are
+    the same as the ones of trackARs.
+    """
+
+    TIME_GAP_ALLOW = config['TIME_GAP_ALLOW']
+    MAX_DIST_ALLOW = config['MAX_DIST_ALLOW']
+    if config['TRACK_SCHEME'] != 'simple':
+        raise ValueError("segmented tracking requires TRACK_SCHEME 'simple'")
+
+    # split records into segments
+    ardf.loc[:, 'time'] = pd.to_datetime(ardf.time)
+    ardf = ardf.dropna(subset=['time'])
+    years = ardf['time'].dt.year
+    segments = (years - years.min()) // segment_years
+    records = [ardf.loc[segments == k] for k in np.unique(segments)]
+
+    # track segments in parallel
+    nseg = len(records)
+    with Pool(min(workers, nseg)) as pool:
+        results = pool.starmap(
+            track_segment,
+            [(rec, TIME_GAP_ALLOW, MAX_DIST_ALLOW, k == nseg - 1)
+             for k, rec in enumerate(records)],
+            chunksize=1)
+
+    # stitch the segments, in order
+    tracks = results[0][0]
+    for k in range(1, nseg):
+        segment, states = results[k]
+        tracks = stitch(tracks, segment, states, records[k], TIME_GAP_ALLOW,
+                        MAX_DIST_ALLOW, last=k == nseg - 1)
+
+    return [AR(i, data) for i, data in enumerate(tracks[0] + tracks[1])]
+
+
+def partition(track_list):
+    """The tracks as a list of lists of (time, id) records."""
+    return [list(zip(tr.data['time'], tr.data['id'])) for tr in track_list]
+
+
+if __name__ == '__main__':
+
+    # argument parameters
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '--config', '-c',
+        type=str,
+        help='path to the config.yml file',
+        default=os.path.join(os.getcwd(), 'config.yml'),
+    )
+    parser.add_argument(
+        '--segment-years',
+        type=int,
+        help='track segments of this many years in parallel, then stitch '
+             'them (only for TRACK_SCHEME "simple")',
+        default=None,
+    )
+    parser.add_argument(
+        '--workers', '-w',
+        type=int,
+        help='number of segments tracked in parallel',
+        default=os.cpu_count(),
     )
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='also run the serial tracking and check that the tracks of the '
+             'segmented tracking are the same',
+    )
+    args = parser.parse_args()
+
+    # load config
+    config = yaml.safe_load(open(args.config))
+
+    # parameters
+    # Int, hours, gap allowed to link 2 records. Should be the time resolution
+    # of the data.
+    TIME_GAP_ALLOW = config['TIME_GAP_ALLOW']
+    # tracking scheme. 'simple': all tracks are simple paths.
+    # 'full': use the network scheme, tracks are connected by their joint
+    # points.
+    TRACK_SCHEME = config['TRACK_SCHEME']  # 'simple' | 'full'
+    # int, max Hausdorff distance in km to define a neighborhood relationship
+    MAX_DIST_ALLOW = config['MAX_DIST_ALLOW']  # km
+    # int, min duration in hrs to keep a track.
+    MIN_DURATION = config['MIN_DURATION']
+    # int, min number of non-relaxed records in a track to keep a track.
+    MIN_NONRELAX = config['MIN_NONRELAX']
+
+    # filesystem
+    output_folder = config['output_folder']
+
+    # combine csv files
+    if not os.path.isfile(os.path.join(
+            output_folder, 'ipart', 'ar', 'ar_records.csv')):
+        os.system(
+            "awk '(NR == 1) || (FNR > 1)' "
+            f"{os.path.join(output_folder, 'ipart', 'ar', '*.csv')}"
+            f" > "
+            f"{os.path.join(output_folder, 'ipart', 'ar', 'ar_records.csv')}"
+        )
 
-# read record
-ardf = readCSVRecord(os.path.join(
-    output_folder, 'ipart', 'ar', 'ar_records.csv'))
+    # read record
+    ardf = readCSVRecord(os.path.join(
+        output_folder, 'ipart', 'ar', 'ar_records.csv'))
 
-# track ARs
-track_list = trackARs(
-    ardf, TIME_GAP_ALLOW, MAX_DIST_ALLOW, track_scheme=TRACK_SCHEME)
+    # track ARs
+    if args.segment_years is None:
+        track_list = trackARs(
+            ardf, TIME_GAP_ALLOW, MAX_DIST_ALLOW, track_scheme=TRACK_SCHEME)
+    else:
+        track_list = track_segmented(ardf.copy(), config, args.segment_years,
+                                     args.workers)
+        if args.check:
+            serial = trackARs(ardf, TIME_GAP_ALLOW, MAX_DIST_ALLOW,
+                              track_scheme=TRACK_SCHEME, verbose=False)
+            a, b = partition(serial), partition(track_list)
+            print(f'# serial: {len(a)} tracks, segmented: {len(b)} tracks')
+            assert a == b
 
-# filter tracks
-if config['do_filter_tracks']:
-    track_list = filterTracks(track_list, MIN_DURATION, MIN_NONRELAX)
+    # filter tracks
+    if config['do_filter_tracks']:
+        track_list = filterTracks(track_list, MIN_DURATION, MIN_NONRELAX)
 
-# collect tracks
-trackdfs = []
-for i in range(len(track_list)):
+    # collect tracks
+    trackdfs = []
+    for i in range(len(track_list)):
 
-    print(i)
+        print(i)
 
-    ti = track_list[i]
-    trackidi = i
-    ti.data.loc[:, 'trackid'] = trackidi
-    ti.trackid = trackidi
+        ti = track_list[i]
+        trackidi = i
+        ti.data.loc[:, 'trackid'] = trackidi
+        ti.trackid = trackidi
 
-    trackdf = ti.data
-    trackdfs.append(trackdf)
+        trackdf = ti.data
+        trackdfs.append(trackdf)
 
-# concat
-trackdf = pd.concat(trackdfs, axis=0, ignore_index=True)
+    # concat
+    trackdf = pd.concat(trackdfs, axis=0, ignore_index=True)
 
-# save data
-abpath_out = os.path.join(output_folder, 'ipart', 'ar', 'ar_tracks.csv')
-np.set_printoptions(threshold=sys.maxsize)
-trackdf.to_csv(abpath_out, index=False)
-trackdf.to_pickle(os.path.join(output_folder, 'ipart', 'ar', 'ar_tracks.pkl'))
+    # save data
+    abpath_out = os.path.join(output_folder, 'ipart', 'ar', 'ar_tracks.csv')
+    np.set_printoptions(threshold=sys.maxsize)
+    trackdf.to_csv(abpath_out, index=False)
+    trackdf.to_pickle(os.path.join(
+        output_folder, 'ipart', 'ar', 'ar_tracks.pkl'))
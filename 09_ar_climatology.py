@@ -0,0 +1,301 @@
+# Copyright (C) 2022 by
+# Dominik Traxl <dominik.traxl@posteo.org>
+# All rights reserved.
+# GPL-3.0 license.
+
+"""Compute gridded AR frequency and IVT climatologies.
+
+The AR label files written by "04" and the IVT of the THR output are read
+in chunks of time steps. For each year, running counts and sums are
+accumulated per grid cell and month (number of time steps, number of time
+steps with an AR, sum of IVT, sum of IVT during ARs) and stored in a
+partial file. Optionally, landfall counts per continent and month are
+accumulated from the output of "06". The partial files of all years are
+then merged by summation into monthly, seasonal and annual products. Years
+can be processed in parallel.
+"""
+
+import os
+import argparse
+from functools import lru_cache
+from multiprocessing import Pool
+
+import yaml
+import numpy as np
+import pandas as pd
+import xarray as xr
+from netCDF4 import Dataset
+
+from nctime import read_times
+
+seasons = {
+    'DJF': [12, 1, 2],
+    'MAM': [3, 4, 5],
+    'JJA': [6, 7, 8],
+    'SON': [9, 10, 11],
+}
+
+
+@lru_cache(maxsize=None)
+def load_track_records(path, min_duration):
+    """Records (time, id) of the tracks lasting >= <min_duration> hours."""
+
+    tracks = pd.read_pickle(path)[['time', 'id', 'trackid']]
+    duration = tracks.groupby('trackid')['time'].agg(
+        lambda t: t.max() - t.min())
+    keep = duration.index[duration >= pd.Timedelta(hours=min_duration)]
+    tracks = tracks.loc[tracks['trackid'].isin(keep)]
+
+    return tracks.groupby('time')['id'].apply(np.asarray).to_dict()
+
+
+def landfall_counts(year, config, records=None):
+    """Count landfalling ARs per month and continent from 06's output."""
+
+    continents = config['landfall_continent_priority']
+    counts = xr.DataArray(
+        np.zeros((12, len(continents)), dtype=np.int64),
+        coords={'month': np.arange(1, 13), 'continent': continents},
+        dims=('month', 'continent'))
+
+    path = os.path.join(config['output_folder'], 'AR_parts', f'{year}.pkl')
+    if not os.path.isfile(path):
+        return None
+    ar = pd.read_pickle(path)
+    ar = ar.loc[ar['lf_ivt'].notnull()]
+    if records is not None:
+        keep = [i in records.get(t, ()) for t, i in zip(ar['time'],
+                                                        ar['id'])]
+        ar = ar.loc[np.asarray(keep, dtype=bool)]
+
+    # landfall continent: the continent of highest priority with land
+    lf = pd.Series(index=ar.index, dtype=object)
+    for c in continents[::-1]:
+        lf.loc[ar[c] > 0] = c
+    for (month, c), n in lf.groupby([ar['time'].dt.month, lf]).size()\
+            .items():
+        counts.loc[month, c] = n
+
+    return counts
+
+
+def accumulate_year(year, config, chunk=100, min_duration=None):
+    """Stream over the label and THR files of a year, accumulate counts and
+    sums per month and grid cell.
+    """
+
+    output_folder = config['output_folder']
+    t, s = config['kernel'][:2]
+    label_file = os.path.join(
+        output_folder, 'ipart', 'ar', f'{year}_labels_angles_ivt.nc')
+    thr_file = os.path.join(
+        output_folder, 'ipart', 'thr', f'{year}-THR-kernel-t{t}-s{s}.nc')
+
+    # track filter
+    records = None
+    if min_duration is not None:
+        records = load_track_records(os.path.join(
+            output_folder, 'ipart', 'ar', 'ar_tracks.pkl'), min_duration)
+
+    fthr = Dataset(thr_file)
+    flab = Dataset(label_file)
+    ivt = fthr.variables['ivt']
+    thr_times = read_times(fthr)
+    tdim, ydim, xdim = ivt.dimensions
+    lat = fthr.variables[ydim][:]
+    lon = fthr.variables[xdim][:]
+    ny, nx = len(lat), len(lon)
+
+    # label time steps (only those with ARs) and their thr indices
+    if 'labels' in flab.variables:
+        labels = flab.variables['labels']
+        lab_times = read_times(flab)
+        lab_tidx = thr_times.get_indexer(lab_times)
+        assert (lab_tidx >= 0).all()
+        assert labels.shape[1:] == (ny, nx)
+    else:
+        labels = None
+        lab_tidx = np.array([], dtype=int)
+
+    # accumulators
+    n_time = np.zeros(12, dtype=np.int64)
+    ar_count = np.zeros((12, ny, nx), dtype=np.int32)
+    ivt_sum = np.zeros((12, ny, nx), dtype=np.float64)
+    ivt_ar_sum = np.zeros((12, ny, nx), dtype=np.float64)
+
+    for i0 in range(0, len(thr_times), chunk):
+        i1 = min(i0 + chunk, len(thr_times))
+        print(f'{year}: {i0}-{i1}/{len(thr_times)}')
+
+        ivtc = np.ma.filled(ivt[i0:i1], 0).astype(np.float64)
+        months = thr_times[i0:i1].month.values
+        for m in np.unique(months):
+            n_time[m-1] += (months == m).sum()
+            ivt_sum[m-1] += ivtc[months == m].sum(axis=0)
+
+        # label time steps within this chunk
+        j0, j1 = np.searchsorted(lab_tidx, [i0, i1])
+        if j1 == j0:
+            continue
+        lab = np.ma.filled(labels[j0:j1], 0)
+        if records is not None:
+            for k in range(j1 - j0):
+                ids = records.get(lab_times[j0 + k], ())
+                lab[k] = np.where(np.isin(lab[k], ids), lab[k], 0)
+        mask = lab > 0
+        ivt_ar = np.where(mask, ivtc[lab_tidx[j0:j1] - i0], 0)
+        lab_months = months[lab_tidx[j0:j1] - i0]
+        for m in np.unique(lab_months):
+            ar_count[m-1] += mask[lab_months == m].sum(axis=0)
+            ivt_ar_sum[m-1] += ivt_ar[lab_months == m].sum(axis=0)
+
+    fthr.close()
+    flab.close()
+
+    ds = xr.Dataset(
+        data_vars={
+            'n_time': (('month',), n_time),
+            'ar_count': (('month', 'latitude', 'longitude'), ar_count),
+            'ivt_sum': (('month', 'latitude', 'longitude'), ivt_sum),
+            'ivt_ar_sum': (('month', 'latitude', 'longitude'), ivt_ar_sum),
+        },
+        coords={'month': np.arange(1, 13), 'latitude': np.asarray(lat),
+                'longitude': np.asarray(lon)},
+        attrs={'years': str(year)},
+    )
+    lf = landfall_counts(year, config, records)
+    if lf is not None:
+        ds['landfall_count'] = lf
+
+    return ds
+
+
+def process_year(year, config, folder, chunk, min_duration, overwrite):
+    """Write the partial file of a year, unless it exists."""
+
+    path = os.path.join(folder, f'{year}.nc')
+    if overwrite or not os.path.isfile(path):
+        ds = accumulate_year(year, config, chunk, min_duration)
+        ds.to_netcdf(path + '.part')
+        os.replace(path + '.part', path)
+
+    return path
+
+
+def merge(paths):
+    """Sum partial files and derive monthly, seasonal and annual products."""
+
+    # variables of all partial files; those missing in a year (e.g.
+    # landfall_count without the output of 06) count as 0
+    zeros = {}
+    for path in paths:
+        with xr.open_dataset(path) as ds:
+            for var in ds.data_vars:
+                if var not in zeros:
+                    zeros[var] = xr.zeros_like(ds[var].load())
+
+    total = None
+    years = []
+    for path in paths:
+        with xr.open_dataset(path) as ds:
+            years.append(ds.attrs['years'])
+            ds = ds.load()
+        for var, zero in zeros.items():
+            if var not in ds:
+                ds[var] = zero
+        if total is None:
+            total = ds
+        else:
+            total = total + ds
+
+    # seasonal and annual sums
+    sums = [total]
+    for season, months in seasons.items():
+        sums.append(total.sel(month=months).sum('month')
+                    .expand_dims(period=[season]))
+    sums.append(total.sum('month').expand_dims(period=['annual']))
+    sums[0] = total.rename({'month': 'period'}).assign_coords(
+        period=[f'{m:02d}' for m in total['month'].values])
+    total = xr.concat(sums, dim='period')
+
+    # products
+    n_time = total['n_time']
+    total['ar_frequency'] = total['ar_count'] / n_time
+    total['ar_frequency'].attrs = {
+        'long_name': 'AR occurrence frequency', 'units': '1'}
+    total['ivt_mean'] = total['ivt_sum'] / n_time
+    total['ivt_mean'].attrs = {
+        'long_name': 'mean IVT', 'units': 'kg m-1 s-1'}
+    total['ivt_ar_mean'] = total['ivt_ar_sum'] / \
+        total['ar_count'].where(total['ar_count'] > 0)
+    total['ivt_ar_mean'].attrs = {
+        'long_name': 'mean IVT during AR occurrence',
+        'units': 'kg m-1 s-1'}
+    total.attrs['years'] = ','.join(sorted(years))
+
+    return total
+
+
+if __name__ == '__main__':
+
+    # argument parameters
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '--config', '-c',
+        type=str,
+        help='path to the config.yml file',
+        default=os.path.join(os.getcwd(), 'config.yml'),
+    )
+    parser.add_argument(
+        '--workers', '-w',
+        type=int,
+        help='number of years processed in parallel',
+        default=1,
+    )
+    parser.add_argument(
+        '--chunk',
+        type=int,
+        help='number of time steps read at once',
+        default=100,
+    )
+    parser.add_argument(
+        '--min-duration',
+        type=float,
+        help='only count ARs that are part of a track (ar_tracks.pkl) '
+             'lasting at least this many hours',
+        default=None,
+    )
+    parser.add_argument(
+        '--overwrite',
+        action='store_true',
+        help='recompute partial files of years that already exist',
+    )
+    args = parser.parse_args()
+
+    # load config
+    config = yaml.safe_load(open(args.config))
+
+    # filesystem
+    output_folder = config['output_folder']
+    if args.min_duration is None:
+        name = 'ar_climatology'
+    else:
+        name = f'ar_climatology_mindur{args.min_duration:g}h'
+    folder = os.path.join(output_folder, 'climatology', name)
+    os.makedirs(folder, exist_ok=True)
+
+    # partial files, one per year
+    years = range(config['year_start'], config['year_end'] + 1)
+    tasks = [(year, config, folder, args.chunk, args.min_duration,
+              args.overwrite) for year in years]
+    with Pool(args.workers) as pool:
+        paths = pool.starmap(process_year, tasks, chunksize=1)
+
+    # merge
+    total = merge(paths)
+    encoding = {v: {'zlib': True} for v in total.data_vars}
+    total.to_netcdf(os.path.join(output_folder, 'climatology', f'{name}.nc'),
+                    encoding=encoding)
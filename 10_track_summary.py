@@ -0,0 +1,190 @@
+# Copyright (C) 2022 by
+# Dominik Traxl <dominik.traxl@posteo.org>
+# All rights reserved.
+# GPL-3.0 license.
+
+"""Summarize the AR catalogue per track.
+
+The records of "ar.pkl" (see "07_aggregate.py") are sorted by trackid and
+time, such that the records of each track are contiguous, and the per-track
+quantities are aggregated at the offsets of the tracks, without grouping:
+
+- start, end, duration and number of records
+- time and location of the first landfall (first record with land > 0)
+- max. IVT at the landfall locations (max. of "lf_ivt")
+- land fraction, the proportion of the cumulative AR area over land (%)
+- number of records making landfall
+
+The swath of a track, the union of the AR contours of all its records, is
+computed in parallel for chunks of tracks, with one batched union per
+track. Swaths crossing the antimeridian are split into a MultiPolygon. The
+track table is stored as "ar_track_summary.pkl/.csv", the swaths as
+"ar_swaths.gpkg", next to "ar.pkl".
+"""
+
+import os
+import argparse
+from multiprocessing import Pool
+
+import yaml
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from pyproj import Geod
+from shapely.geometry import Polygon, box
+from shapely.affinity import translate
+from shapely.ops import unary_union
+
+
+def track_offsets(trackid):
+    """Start and end offsets of the tracks in an array of sorted trackids."""
+
+    if len(trackid) == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+
+    starts = np.flatnonzero(np.r_[True, trackid[1:] != trackid[:-1]])
+    ends = np.r_[starts[1:], len(trackid)]
+
+    return starts, ends
+
+
+def summarize_tracks(ar):
+    """Per-track summary of the records <ar>, sorted by trackid and time."""
+
+    starts, ends = track_offsets(ar['trackid'].values)
+    n = len(ar)
+
+    # start, end, duration
+    time = ar['time'].values
+    track = pd.DataFrame({
+        'trackid': ar['trackid'].values[starts],
+        'start': time[starts],
+        'end': time[ends - 1],
+        'n_records': ends - starts,
+    })
+    track['duration'] = (track['end'] - track['start']) / pd.Timedelta('1h')
+
+    # first landfall
+    landfall = ar['land'].values > 0
+    first = np.minimum.reduceat(np.where(landfall, np.arange(n), n), starts)
+    has_lf = first < ends
+    first = np.where(has_lf, first, 0)
+    for col, src in [('lf_time', 'time'), ('lf_lon', 'lf_lon'),
+                     ('lf_lat', 'lf_lat')]:
+        track[col] = pd.Series(ar[src].values[first]).where(has_lf)
+
+    # max ivt at the landfall locations, ignoring records without landfall
+    track['max_lf_ivt'] = np.fmax.reduceat(
+        ar['lf_ivt'].values.astype(float), starts)
+
+    # land fraction of the cumulative area, and number of landfalls
+    area = np.nan_to_num(ar['ar_area'].values.astype(float))
+    land_area = np.nan_to_num(ar['land'].values.astype(float)) * area
+    total = np.add.reduceat(area, starts)
+    track['land'] = np.divide(np.add.reduceat(land_area, starts), total,
+                              out=np.full(len(starts), np.nan),
+                              where=total > 0)
+    track['n_landfall'] = np.add.reduceat(landfall.astype(int), starts)
+
+    return track
+
+
+def unwrap(lons):
+    """Longitudes of a contour, continuous across the antimeridian."""
+    return np.rad2deg(np.unwrap(np.deg2rad(np.asarray(lons, dtype=float))))
+
+
+def split_antimeridian(geom):
+    """Move the parts of <geom> beyond longitudes [-180, 180] back into the
+    range, such that a swath crossing the antimeridian is split into a
+    MultiPolygon.
+    """
+
+    parts = []
+    for k in [-360, 0, 360]:
+        # buffer(0) drops lines and points of the intersection
+        part = geom.intersection(box(-180 - k, -90, 180 - k, 90)).buffer(0)
+        if not part.is_empty:
+            parts.append(translate(part, xoff=k))
+
+    return unary_union(parts)
+
+
+def track_swaths(contours_x, contours_y, counts):
+    """Swaths and their areas (km^2) of consecutive tracks with <counts>
+    records each.
+    """
+
+    geod = Geod(ellps='WGS84')
+    swaths = []
+    areas = []
+    i = 0
+    for n in counts:
+        polygons = [Polygon(zip(unwrap(x), y)).buffer(0)
+                    for x, y in zip(contours_x[i:i+n], contours_y[i:i+n])]
+        swath = split_antimeridian(unary_union(polygons))
+        swaths.append(swath)
+        areas.append(abs(geod.geometry_area_perimeter(swath)[0]) / 1e6)
+        i += n
+
+    return swaths, areas
+
+
+if __name__ == '__main__':
+
+    # argument parameters
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '--config', '-c',
+        type=str,
+        help='path to the config.yml file',
+        default=os.path.join(os.getcwd(), 'config.yml'),
+    )
+    parser.add_argument(
+        '--workers', '-w',
+        type=int,
+        help='number of processes computing the swaths',
+        default=os.cpu_count(),
+    )
+    args = parser.parse_args()
+
+    # load config
+    config = yaml.safe_load(open(args.config))
+
+    # filesystem
+    output_folder = config['output_folder']
+
+    # load data, contiguous records per track
+    ar = pd.read_pickle(os.path.join(output_folder, 'ar.pkl'))
+    ar = ar.sort_values(['trackid', 'time'], kind='stable',
+                        ignore_index=True)
+
+    # track table
+    track = summarize_tracks(ar)
+    print(f'{len(track)} tracks')
+
+    # swaths, in chunks of tracks
+    counts = track['n_records'].values
+    nchunks = min(4 * args.workers, len(track))
+    chunks = np.array_split(np.arange(len(track)), nchunks) if nchunks else []
+    tasks = []
+    for chunk in chunks:
+        i0 = counts[:chunk[0]].sum()
+        i1 = i0 + counts[chunk].sum()
+        tasks.append((ar['contour_x'].values[i0:i1],
+                      ar['contour_y'].values[i0:i1], counts[chunk]))
+    with Pool(args.workers) as pool:
+        results = pool.starmap(track_swaths, tasks, chunksize=1)
+    swaths = [s for result in results for s in result[0]]
+    track['swath_area'] = [a for result in results for a in result[1]]
+
+    # store
+    track.to_pickle(os.path.join(output_folder, 'ar_track_summary.pkl'))
+    track.to_csv(os.path.join(output_folder, 'ar_track_summary.csv'),
+                 index=False)
+    gpd.GeoDataFrame(track[['trackid']], geometry=swaths,
+                     crs='EPSG:4326').to_file(
+        os.path.join(output_folder, 'ar_swaths.gpkg'), driver='GPKG')
@@ -0,0 +1,267 @@
+# Copyright (C) 2022 by
+# Dominik Traxl <dominik.traxl@posteo.org>
+# All rights reserved.
+# GPL-3.0 license.
+
+"""Benchmark the pipeline offline on synthetic ERA5-like data.
+
+For each problem size, synthetic uflux/vflux files are written with
+"synthetic_ivt.py", and the scripts "01" to "07" are run on them with a
+config derived from the given config.yml. Wall time, peak memory (maximum
+resident set size of the stage's processes) and throughput (simulated hours
+per second) are recorded for each stage, stored as JSON, and can be compared
+against a stored baseline.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import subprocess
+
+import yaml
+import pandas as pd
+
+scripts_folder = os.path.dirname(os.path.abspath(__file__))
+
+# problem sizes: input grid resolution, regridded resolution and years
+sizes = {
+    'small': {'input_resolution': 2.5, 'spatial_resolution': 5.0,
+              'years': 2},
+    'medium': {'input_resolution': 1.0, 'spatial_resolution': 2.25,
+               'years': 2},
+    'large': {'input_resolution': 0.25, 'spatial_resolution': 0.75,
+              'years': 2},
+}
+
+# pipeline stages and whether they are run once per year
+stages = [
+    ('01_regrid_ivt.py', True),
+    ('02_aggregate.py', False),
+    ('03_ipart_ar_tracking_thr_multifile.py', False),
+    ('04_ipart_ar_tracking_detection.py', True),
+    ('05_ipart_ar_tracking_trace_over_time.py', False),
+    ('06_ar_landfall_continents.py', True),
+    ('07_aggregate.py', False),
+]
+
+
+def run(cmd, log):
+    """Run a command, return its wall time [s] and max. RSS [MB]."""
+
+    t0 = time.perf_counter()
+    p = subprocess.Popen(cmd, cwd=scripts_folder, stdout=log,
+                         stderr=subprocess.STDOUT)
+    _, status, rusage = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - t0
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, cmd)
+
+    # ru_maxrss is given in kilobytes on linux
+    return wall, rusage.ru_maxrss / 1024
+
+
+def scale_kernel(kernel, resolution, benchmark_resolution):
+    """The THR kernel for <benchmark_resolution>, covering the same spatial
+    extent (in degrees) as <kernel> at <resolution>.
+    """
+
+    factor = resolution / benchmark_resolution
+    return [kernel[0]] + [max(1, int(round(k * factor))) for k in kernel[1:]]
+
+
+def benchmark_size(name, base_config, workdir, ars_per_day, seed):
+    """Generate synthetic data for one size and run all stages on it."""
+
+    size = sizes[name]
+    folder = os.path.join(workdir, name)
+
+    # start from an empty folder, e.g. 05 would reuse a stale ar_records.csv
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder)
+
+    # derived config
+    config = dict(base_config)
+    year_start = base_config['year_start']
+    config.update({
+        'scripts_folder': scripts_folder,
+        'data_folder_e': os.path.join(folder, 'era5', 'e', ''),
+        'data_folder_n': os.path.join(folder, 'era5', 'n', ''),
+        'output_folder': os.path.join(folder, 'output', ''),
+        'year_start': year_start,
+        'year_end': year_start + size['years'] - 1,
+        'do_regridding': True,
+        'spatial_resolution': size['spatial_resolution'],
+        'kernel': scale_kernel(base_config['kernel'],
+                               base_config['spatial_resolution'],
+                               size['spatial_resolution']),
+    })
+    config_file = os.path.join(folder, 'config.yml')
+    with open(config_file, 'w') as f:
+        yaml.safe_dump(config, f)
+    years = range(config['year_start'], config['year_end'] + 1)
+    nhours = sum(pd.Timestamp(year, 12, 31).day_of_year * 24
+                 for year in years)
+
+    results = {}
+    log = open(os.path.join(folder, 'benchmark.log'), 'w')
+
+    # synthetic input data
+    print(f'{name}: writing synthetic input data')
+    cmd = [sys.executable, 'synthetic_ivt.py', '-c', config_file,
+           '-r', str(size['input_resolution']),
+           '--ars-per-day', str(ars_per_day), '--seed', str(seed)]
+    wall, rss = run(cmd, log)
+    results['synthetic_ivt.py'] = {'wall': wall, 'max_rss': rss}
+
+    for script, per_year in stages:
+        print(f'{name}: running {script}')
+        walls = []
+        rsss = []
+        for year in (years if per_year else [None]):
+            cmd = [sys.executable, script, '-c', config_file]
+            if year is not None:
+                cmd.insert(2, str(year))
+            wall, rss = run(cmd, log)
+            walls.append(wall)
+            rsss.append(rss)
+        results[script] = {'wall': sum(walls), 'max_rss': max(rsss)}
+
+    log.close()
+
+    for result in results.values():
+        result['hours_per_s'] = nhours / result['wall']
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Compare results against a baseline, return the table and regressions.
+    """
+
+    rows = []
+    for name, stages_ in results.items():
+        for script, result in stages_.items():
+            try:
+                base = baseline['results'][name][script]
+            except KeyError:
+                continue
+            rows.append({
+                'size': name,
+                'stage': script,
+                'wall': result['wall'],
+                'wall_baseline': base['wall'],
+                'wall_ratio': result['wall'] / base['wall'],
+                'max_rss': result['max_rss'],
+                'max_rss_baseline': base['max_rss'],
+                'max_rss_ratio': result['max_rss'] / base['max_rss'],
+            })
+    table = pd.DataFrame(rows)
+    if len(table) == 0:
+        return table, table
+    regressions = table.loc[(table['wall_ratio'] > 1 + tolerance) |
+                            (table['max_rss_ratio'] > 1 + tolerance)]
+
+    return table, regressions
+
+
+if __name__ == '__main__':
+
+    # argument parameters
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '--config', '-c',
+        type=str,
+        help='path to the config.yml file, used for all parameters except '
+             'folders, years and spatial resolution',
+        default=os.path.join(os.getcwd(), 'config.yml'),
+    )
+    parser.add_argument(
+        '--sizes', '-s',
+        nargs='+',
+        choices=list(sizes),
+        help='problem sizes to benchmark',
+        default=['small'],
+    )
+    parser.add_argument(
+        '--workdir', '-w',
+        type=str,
+        help='folder to store synthetic data and pipeline output',
+        default=os.path.join(os.getcwd(), 'benchmark'),
+    )
+    parser.add_argument(
+        '--ars-per-day',
+        type=float,
+        help='mean number of synthetic ARs started per day',
+        default=2.,
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        help='seed of the synthetic data',
+        default=0,
+    )
+    parser.add_argument(
+        '--output', '-o',
+        type=str,
+        help='store results as JSON in this file',
+        default=None,
+    )
+    parser.add_argument(
+        '--baseline', '-b',
+        type=str,
+        help='compare results against this JSON file of a previous run',
+        default=None,
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        help='relative increase of wall time/memory against the baseline '
+             'that is reported as a regression',
+        default=0.1,
+    )
+    args = parser.parse_args()
+
+    # load config
+    config = yaml.safe_load(open(args.config))
+
+    # run benchmarks
+    results = {}
+    for name in args.sizes:
+        results[name] = benchmark_size(name, config, args.workdir,
+                                       args.ars_per_day, args.seed)
+
+    # print results
+    for name, stages_ in results.items():
+        print(f'\n{name}')
+        print(pd.DataFrame(stages_).T.to_string(float_format='%.2f'))
+
+    # store results
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'date': pd.Timestamp.now().isoformat(),
+                'host': socket.gethostname(),
+                'python': sys.version,
+                'sizes': {name: sizes[name] for name in results},
+                'results': results,
+            }, f, indent=2)
+
+    # compare against baseline
+    if args.baseline is not None:
+        baseline = json.load(open(args.baseline))
+        table, regressions = compare(results, baseline, args.tolerance)
+        print('\ncomparison against baseline')
+        print(table.to_string(float_format='%.2f'))
+        if len(regressions) > 0:
+            print(f'\n{len(regressions)} regression(s) larger than '
+                  f'{args.tolerance:.0%}')
+            sys.exit(1)
@@ -0,0 +1,204 @@
+# Copyright (C) 2022 by
+# Dominik Traxl <dominik.traxl@posteo.org>
+# All rights reserved.
+# GPL-3.0 license.
+
+"""Compare the THR and detection outputs of two runs of the pipeline.
+
+Typically used to check a run with dtype 'float32' against a reference run
+with dtype 'float64' (two config.yml files with different output folders).
+Note that the THR files are only stored with the given dtype by
+"03_ipart_ar_tracking_thr_multifile.py --parallel"; ipart's rotatingTHR (03
+without --parallel) always stores float32, so the reference run should use
+--parallel.
+For each year, the report contains
+
+- the max. absolute/relative differences of the THR fields
+- the intersection over union of the AR masks (labels > 0)
+- the number of AR records of both runs, how many of them could be matched
+  (same time, centroids closer than --max-dist), and the max. absolute and
+  relative differences of the numeric record attributes of matched ARs
+"""
+
+import os
+import argparse
+
+import yaml
+import numpy as np
+import pandas as pd
+from netCDF4 import Dataset
+from scipy.optimize import linear_sum_assignment
+
+from nctime import read_times
+
+# numeric columns of the AR records compared between runs
+record_columns = ['centroid_y', 'centroid_x', 'area', 'length', 'width',
+                  'LW_ratio', 'strength', 'strength_ano', 'strength_std',
+                  'max_strength', 'mean_angle', 'is_relaxed', 'qv_mean']
+
+
+def thr_diff(ref_file, test_file, chunk=100):
+    """Max. absolute and relative differences of the THR fields."""
+
+    report = {}
+    with Dataset(ref_file) as fref, Dataset(test_file) as ftest:
+        for var in ['ivt', 'ivt_rec', 'ivt_ano']:
+            vref = fref.variables[var]
+            vtest = ftest.variables[var]
+            assert vref.shape == vtest.shape
+            diff = 0.
+            vmax = 0.
+            for i0 in range(0, vref.shape[0], chunk):
+                a = np.ma.filled(vref[i0:i0+chunk], 0).astype(np.float64)
+                b = np.ma.filled(vtest[i0:i0+chunk], 0).astype(np.float64)
+                diff = max(diff, np.abs(a - b).max())
+                vmax = max(vmax, np.abs(a).max())
+            report[f'{var}_abs'] = diff
+            report[f'{var}_rel'] = diff / vmax if vmax > 0 else 0.
+
+    return report
+
+
+def mask_iou(ref_file, test_file):
+    """Intersection over union of the AR masks of all time steps."""
+
+    with Dataset(ref_file) as fref, Dataset(test_file) as ftest:
+        if 'labels' not in fref.variables or \
+                'labels' not in ftest.variables:
+            return np.nan
+        tref = read_times(fref)
+        ttest = read_times(ftest)
+        intersection = 0
+        union = 0
+        for time in tref.union(ttest):
+            a = b = False
+            if time in tref:
+                a = np.ma.filled(
+                    fref.variables['labels'][tref.get_loc(time)], 0) > 0
+            if time in ttest:
+                b = np.ma.filled(
+                    ftest.variables['labels'][ttest.get_loc(time)], 0) > 0
+            intersection += np.sum(a & b)
+            union += np.sum(a | b)
+
+    return intersection / union if union > 0 else 1.
+
+
+def centroid_distance(a, b):
+    """Great circle distances (km) between the centroids of two tables."""
+
+    lat1 = np.radians(a['centroid_y'].values)[:, None]
+    lat2 = np.radians(b['centroid_y'].values)[None, :]
+    dlon = np.radians(a['centroid_x'].values[:, None] -
+                      b['centroid_x'].values[None, :])
+    hav = np.sin((lat2 - lat1) / 2)**2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+
+    return 2 * 6371 * np.arcsin(np.sqrt(np.clip(hav, 0, 1)))
+
+
+def record_diff(ref_file, test_file, max_dist=100.):
+    """Match the AR records of both runs, compare their attributes."""
+
+    ref = pd.read_csv(ref_file, usecols=['time'] + record_columns)
+    test = pd.read_csv(test_file, usecols=['time'] + record_columns)
+
+    pairs = []
+    for time, a in ref.groupby('time'):
+        b = test.loc[test['time'] == time]
+        if len(b) == 0:
+            continue
+        dist = centroid_distance(a, b)
+        rows, cols = linear_sum_assignment(dist)
+        keep = dist[rows, cols] <= max_dist
+        pairs.append((a.index[rows[keep]], b.index[cols[keep]]))
+
+    report = {'n_ref': len(ref), 'n_test': len(test), 'n_matched': 0}
+    if pairs:
+        iref = np.concatenate([p[0] for p in pairs])
+        itest = np.concatenate([p[1] for p in pairs])
+        report['n_matched'] = len(iref)
+        a = ref.loc[iref, record_columns].to_numpy(dtype=np.float64)
+        b = test.loc[itest, record_columns].to_numpy(dtype=np.float64)
+        diff = np.abs(a - b)
+        scale = np.abs(a)
+        for j, col in enumerate(record_columns):
+            report[f'{col}_abs'] = diff[:, j].max() if len(diff) else 0.
+            rel = diff[:, j][scale[:, j] > 0] / scale[:, j][scale[:, j] > 0]
+            report[f'{col}_rel'] = rel.max() if len(rel) else 0.
+
+    return report
+
+
+def compare_year(year, ref_config, test_config, max_dist=100.):
+    """Report of the differences between two runs for one year."""
+
+    t, s = test_config['kernel'][:2]
+    thr_name = f'{year}-THR-kernel-t{t}-s{s}.nc'
+    report = {'year': year}
+
+    ref_folder = os.path.join(ref_config['output_folder'], 'ipart')
+    test_folder = os.path.join(test_config['output_folder'], 'ipart')
+    if os.path.isfile(os.path.join(test_folder, 'thr', thr_name)):
+        report.update(thr_diff(os.path.join(ref_folder, 'thr', thr_name),
+                               os.path.join(test_folder, 'thr', thr_name)))
+    report['mask_iou'] = mask_iou(
+        os.path.join(ref_folder, 'ar', f'{year}_labels_angles_ivt.nc'),
+        os.path.join(test_folder, 'ar', f'{year}_labels_angles_ivt.nc'))
+    report.update(record_diff(
+        os.path.join(ref_folder, 'ar', f'{year}_ar_records.csv'),
+        os.path.join(test_folder, 'ar', f'{year}_ar_records.csv'),
+        max_dist))
+
+    return report
+
+
+if __name__ == '__main__':
+
+    # argument parameters
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        'reference',
+        type=str,
+        help='path to the config.yml file of the reference run',
+    )
+    parser.add_argument(
+        '--config', '-c',
+        type=str,
+        help='path to the config.yml file of the run to compare',
+        default=os.path.join(os.getcwd(), 'config.yml'),
+    )
+    parser.add_argument(
+        '--max-dist',
+        type=float,
+        help='max. distance (km) between the centroids of matched ARs',
+        default=100.,
+    )
+    parser.add_argument(
+        '--output', '-o',
+        type=str,
+        help='store the report as csv file',
+        default=None,
+    )
+    args = parser.parse_args()
+
+    # load configs
+    ref_config = yaml.safe_load(open(args.reference))
+    test_config = yaml.safe_load(open(args.config))
+    print(f"reference: {ref_config.get('dtype', 'float64')}, "
+          f"compared: {test_config.get('dtype', 'float64')}")
+
+    # compare year by year
+    years = range(test_config['year_start'], test_config['year_end'] + 1)
+    report = pd.DataFrame([compare_year(year, ref_config, test_config,
+                                        args.max_dist) for year in years])
+    report = report.set_index('year')
+    with pd.option_context('display.max_rows', None,
+                           'display.float_format', '{:.3e}'.format):
+        print(report.T)
+
+    if args.output is not None:
+        report.to_csv(args.output)
@@ -0,0 +1,85 @@
+# Copyright (C) 2022 by
+# Dominik Traxl <dominik.traxl@posteo.org>
+# All rights reserved.
+# GPL-3.0 license.
+
+"""Regional domain of the pipeline, see "domain" in config.yml.
+
+The domain is given as [lat_south, lat_north, lon_west, lon_east] in degrees,
+with lon_west < lon_east (longitudes may be negative, e.g. [20, 75, -80, 40]
+for the North Atlantic and Europe). "01_regrid_ivt.py" regrids onto the domain
+plus "domain_margin" degrees, the THR is computed on this extended grid and
+cropped to the domain, and all later stages work on the domain only. A domain
+covering all longitudes (lon_east - lon_west >= 360) is a zonal band: only
+the latitudes are restricted, and the data stay zonally cyclic.
+"""
+
+import numpy as np
+
+
+def get_domain(config):
+    """(lat_south, lat_north, lon_west, lon_east) of the domain, or None for
+    the globe.
+    """
+
+    domain = config.get('domain')
+    if domain is None:
+        return None
+
+    lat_s, lat_n, lon_w, lon_e = [float(d) for d in domain]
+    if not -90 <= lat_s < lat_n <= 90:
+        raise ValueError(f'invalid latitudes of domain {domain}')
+    if not lon_w < lon_e:
+        raise ValueError(f'invalid longitudes of domain {domain}')
+
+    return lat_s, lat_n, lon_w, lon_e
+
+
+def is_cyclic(domain):
+    """Whether the data of the domain are zonally cyclic."""
+    return domain is None or domain[3] - domain[2] >= 360
+
+
+def extended_domain(config):
+    """The domain plus the margin, on grid points of the output resolution.
+    Returns (lats, lons) of the grid to regrid onto.
+    """
+
+    res = config['spatial_resolution']
+    domain = get_domain(config)
+    lats = np.arange(90, -90-res, -res)
+    lons = np.arange(0, 360, res)
+    if domain is None:
+        return lats, lons
+
+    lat_s, lat_n, lon_w, lon_e = domain
+    margin = config.get('domain_margin', 0)
+    lats = lats[(lats >= lat_s - margin) & (lats <= lat_n + margin)]
+    if is_cyclic(domain):
+        return lats, lons
+
+    x0 = np.floor((lon_w - margin) / res) * res
+    x1 = np.ceil((lon_e + margin) / res) * res
+    lons = np.arange(x0, x1 + res / 2, res)
+
+    return lats, lons
+
+
+def crop(varNV, domain):
+    """Crop a (time, latitude, longitude) NCVAR to the domain."""
+
+    if domain is None:
+        return varNV
+
+    lat_s, lat_n, lon_w, lon_e = domain
+    lats = np.asarray(varNV.getLatitude())
+    idx = np.flatnonzero((lats >= lat_s) & (lats <= lat_n))
+    varNV = varNV.sliceIndex(idx[0], idx[-1] + 1, axis=1, squeeze=False)
+    if is_cyclic(domain):
+        return varNV
+
+    lons = np.asarray(varNV.getLongitude())
+    idx = np.flatnonzero((lons >= lon_w) & (lons <= lon_e))
+    assert np.all(np.diff(idx) == 1)
+
+    return varNV.sliceIndex(idx[0], idx[-1] + 1, axis=2, squeeze=False)
@@ -0,0 +1,18 @@
+# Copyright (C) 2022 by
+# Dominik Traxl <dominik.traxl@posteo.org>
+# All rights reserved.
+# GPL-3.0 license.
+
+"""Time axes of the netcdf outputs of the pipeline (THR and label files)."""
+
+import pandas as pd
+from netCDF4 import num2date
+
+
+def read_times(ncfile):
+    """Read the time axis of an open netcdf file, rounded to full hours."""
+    tvar = ncfile.variables['time']
+    times = num2date(tvar[:], tvar.units,
+                     only_use_cftime_datetimes=False,
+                     only_use_python_datetimes=True)
+    return pd.DatetimeIndex(times).round('h')
@@ -0,0 +1,119 @@
+# Copyright (C) 2022 by
+# Dominik Traxl <dominik.traxl@posteo.org>
+# All rights reserved.
+# GPL-3.0 license.
+
+"""Run the per-year stages for all years with persistent worker processes.
+
+Instead of starting one interpreter per year, a pool of worker processes
+imports the heavy dependencies of the requested stages once, and keeps
+static inputs (regridding weights, continents, AR tracks) cached across the
+years it processes. Stages are run one after another, each over all years
+given in config.yml (or --years).
+"""
+
+import os
+import time
+import argparse
+import importlib.util
+import multiprocessing
+
+import yaml
+
+scripts_folder = os.path.dirname(os.path.abspath(__file__))
+
+# stage name: (script, per-year function)
+stages = {
+    'regrid': ('01_regrid_ivt.py', 'regrid_year'),
+    'thr': ('03_ipart_ar_tracking_thr_multifile.py', 'thr_year'),
+    'detect': ('04_ipart_ar_tracking_detection.py', 'detect_year'),
+    'landfall': ('06_ar_landfall_continents.py', 'landfall_year'),
+}
+
+# per-worker state, set by init_worker
+config = None
+functions = {}
+
+
+def load_script(script):
+    """Import one of the numbered scripts as a module."""
+
+    name = 'artracks_' + os.path.splitext(script)[0]
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(scripts_folder, script))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def init_worker(config_file, stage_names):
+    """Load config and import the scripts of the stages, once per worker."""
+
+    global config
+    config = yaml.safe_load(open(config_file))
+    for stage in stage_names:
+        script, function = stages[stage]
+        functions[stage] = getattr(load_script(script), function)
+
+
+def run_year(task):
+    """Run a stage for one year, return its wall time."""
+
+    stage, year = task
+    t0 = time.perf_counter()
+    functions[stage](str(year), config)
+
+    return stage, year, time.perf_counter() - t0
+
+
+if __name__ == '__main__':
+
+    # argument parameters
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        'stages',
+        nargs='+',
+        choices=list(stages),
+        help='stages to run, in the given order',
+    )
+    parser.add_argument(
+        '--config', '-c',
+        type=str,
+        help='path to the config.yml file',
+        default=os.path.join(os.getcwd(), 'config.yml'),
+    )
+    parser.add_argument(
+        '--workers', '-w',
+        type=int,
+        help='number of worker processes',
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        '--years', '-y',
+        type=int,
+        nargs='+',
+        help='years to process, defaults to the range given in config.yml',
+        default=None,
+    )
+    args = parser.parse_args()
+
+    # load config
+    config = yaml.safe_load(open(args.config))
+
+    # years
+    if args.years is None:
+        years = list(range(config['year_start'], config['year_end'] + 1))
+    else:
+        years = args.years
+
+    with multiprocessing.Pool(
+            min(args.workers, len(years)), initializer=init_worker,
+            initargs=(args.config, args.stages)) as pool:
+        for stage in args.stages:
+            tasks = [(stage, year) for year in years]
+            for stage_, year, wall in pool.imap_unordered(run_year, tasks):
+                print(f'{stage_} {year}: {wall:.1f}s')
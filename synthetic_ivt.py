@@ -0,0 +1,230 @@
+# Copyright (C) 2022 by
+# Dominik Traxl <dominik.traxl@posteo.org>
+# All rights reserved.
+# GPL-3.0 license.
+
+"""Write synthetic, ERA5-like yearly uflux/vflux files.
+
+The files are stored as "{year}.nc" in the folders given by "data_folder_e"
+and "data_folder_n" of the config, with the same layout as the original ERA5
+downloads (hourly time steps, latitude from 90 to -90, longitude from 0 to
+360). On top of a zonal background flow with travelling waves, elongated
+filaments of strong poleward moisture transport are embedded, which move
+eastwards and grow/decay over their lifetime, so that the IPART stages have
+atmospheric river-like structures to detect and track.
+"""
+
+import os
+import argparse
+
+import yaml
+import numpy as np
+import pandas as pd
+from netCDF4 import Dataset
+
+# era5 variable names and metadata
+variables = {
+    'e': ('p71.162', 'Vertical integral of eastward water vapour flux'),
+    'n': ('p72.162', 'Vertical integral of northward water vapour flux'),
+}
+
+
+def draw_filaments(rng, nhours, ars_per_day):
+    """Draw random filament (AR) parameters for one year."""
+
+    n = rng.poisson(ars_per_day * nhours / 24)
+    hemisphere = rng.choice([-1, 1], n)
+    return pd.DataFrame(data={
+        't0': rng.uniform(-72, nhours, n),  # hours
+        'duration': rng.uniform(36, 144, n),  # hours
+        'lat0': hemisphere * rng.uniform(25, 45, n),  # degrees
+        'lon0': rng.uniform(0, 360, n),  # degrees
+        'angle': hemisphere * np.radians(rng.uniform(20, 50, n)),
+        'length': rng.uniform(30, 55, n),  # degrees
+        'width': rng.uniform(5, 9, n),  # degrees
+        'peak': rng.uniform(500, 1000, n),  # kg/m/s
+        'speed': rng.uniform(.2, .6, n),  # degrees longitude per hour
+        'drift': hemisphere * rng.uniform(0, .1, n),  # degrees lat. per hour
+    })
+
+
+def synthetic_flux(hours, lat, lon, filaments, rng, noise=10.):
+    """Compute uflux/vflux [kg/m/s] at the given hours since the year start.
+
+    Returns two float32 arrays of shape (len(hours), len(lat), len(lon)).
+    """
+
+    shape = (len(hours), len(lat), len(lon))
+
+    # background: westerly jets in both hemispheres with travelling waves
+    jet = np.exp(-((np.abs(lat) - 45) / 15)**2)[None, :, None]
+    phase = 5 * np.radians(lon)[None, None, :] - \
+        2 * np.pi * hours[:, None, None] / 120
+    u = (30 + 150 * jet + 40 * jet * np.sin(phase)).astype(np.float32)
+    v = (40 * jet * np.cos(phase)).astype(np.float32)
+    u += noise * rng.standard_normal(shape, dtype=np.float32)
+    v += noise * rng.standard_normal(shape, dtype=np.float32)
+
+    # filaments alive during the given hours
+    active = filaments.loc[
+        (filaments['t0'] < hours[-1]) &
+        (filaments['t0'] + filaments['duration'] > hours[0])]
+
+    for f in active.itertuples():
+
+        # time steps where filament is alive
+        age = hours - f.t0
+        it = np.where((age >= 0) & (age <= f.duration))[0]
+        if len(it) == 0:
+            continue
+        age = age[it]
+        envelope = np.sin(np.pi * age / f.duration)
+
+        # only the latitude band the filament can reach
+        reach = f.length / 2 + f.width + abs(f.drift) * f.duration
+        iy = np.where(np.abs(lat - f.lat0) <= reach)[0]
+        if len(iy) == 0:
+            continue
+
+        # filament centre and local along/across coordinates in degrees
+        clat = f.lat0 + f.drift * age
+        clon = f.lon0 + f.speed * age
+        dy = lat[iy][None, :, None] - clat[:, None, None]
+        dx = (lon[None, None, :] - clon[:, None, None] + 180) % 360 - 180
+        dx = dx * np.cos(np.radians(lat[iy]))[None, :, None]
+        along = dx * np.cos(f.angle) + dy * np.sin(f.angle)
+        across = -dx * np.sin(f.angle) + dy * np.cos(f.angle)
+
+        # flat-topped along the axis, gaussian across the axis
+        m = f.peak * envelope[:, None, None] * \
+            np.exp(-(across / (f.width / 2))**2) * \
+            np.exp(-(along / (f.length / 2))**4)
+
+        u[it[:, None], iy[None, :]] += \
+            (m * np.cos(f.angle)).astype(np.float32)
+        v[it[:, None], iy[None, :]] += \
+            (m * np.sin(f.angle)).astype(np.float32)
+
+    return u, v
+
+
+def create_file(path, varname, long_name, times, lat, lon, packed):
+    """Create an empty ERA5-like netCDF file for one variable."""
+
+    ds = Dataset(path, 'w')
+    ds.createDimension('longitude', len(lon))
+    ds.createDimension('latitude', len(lat))
+    ds.createDimension('time', None)
+
+    lonv = ds.createVariable('longitude', 'f4', ('longitude',))
+    lonv.units = 'degrees_east'
+    lonv.long_name = 'longitude'
+    lonv[:] = lon
+    latv = ds.createVariable('latitude', 'f4', ('latitude',))
+    latv.units = 'degrees_north'
+    latv.long_name = 'latitude'
+    latv[:] = lat
+    timev = ds.createVariable('time', 'i4', ('time',))
+    timev.units = 'hours since 1900-01-01 00:00:00.0'
+    timev.long_name = 'time'
+    timev.calendar = 'gregorian'
+    timev[:] = (times - pd.Timestamp(1900, 1, 1)) // pd.Timedelta(hours=1)
+
+    chunks = [1, len(lat), len(lon)]
+    if packed:
+        # era5 style packing into shorts
+        var = ds.createVariable(varname, 'i2', ('time', 'latitude',
+                                'longitude'), fill_value=-32767,
+                                chunksizes=chunks)
+        var.scale_factor = 5000 / 2**16
+        var.add_offset = 0.
+    else:
+        var = ds.createVariable(varname, 'f4', ('time', 'latitude',
+                                'longitude'), chunksizes=chunks)
+    var.units = 'kg m**-1 s**-1'
+    var.long_name = long_name
+
+    return ds
+
+
+def write_year(year, config, resolution, ars_per_day=2., seed=0,
+               packed=False):
+    """Write the synthetic uflux/vflux files of one year."""
+
+    rng = np.random.default_rng([seed, int(year)])
+
+    # era5-like grid and hourly time axis
+    lat = np.arange(90, -90 - resolution / 2, -resolution)
+    lon = np.arange(0, 360, resolution)
+    days_in_year = pd.Timestamp(int(year), 12, 31).day_of_year
+    times = pd.date_range(f'{year}-01-01', periods=days_in_year * 24,
+                          freq='h')
+    filaments = draw_filaments(rng, len(times), ars_per_day)
+
+    files = {}
+    for key, (varname, long_name) in variables.items():
+        folder = config[f'data_folder_{key}']
+        os.makedirs(folder, exist_ok=True)
+        files[key] = create_file(os.path.join(folder, f'{year}.nc'),
+                                 varname, long_name, times, lat, lon, packed)
+
+    # write one day at a time
+    for day in range(days_in_year):
+        print(f'{year}-{day+1:03d}')
+        hours = np.arange(day * 24, (day + 1) * 24, dtype=float)
+        u, v = synthetic_flux(hours, lat, lon, filaments, rng)
+        files['e'].variables[variables['e'][0]][day*24:(day+1)*24] = u
+        files['n'].variables[variables['n'][0]][day*24:(day+1)*24] = v
+
+    for ds in files.values():
+        ds.close()
+
+    return filaments
+
+
+if __name__ == '__main__':
+
+    # argument parameters
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '--config', '-c',
+        type=str,
+        help='path to the config.yml file',
+        default=os.path.join(os.getcwd(), 'config.yml'),
+    )
+    parser.add_argument(
+        '--resolution', '-r',
+        type=float,
+        help='spatial resolution of the input grid in degrees',
+        default=0.25,
+    )
+    parser.add_argument(
+        '--ars-per-day',
+        type=float,
+        help='mean number of filaments (ARs) started per day',
+        default=2.,
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        help='seed of the random number generator',
+        default=0,
+    )
+    parser.add_argument(
+        '--packed',
+        action='store_true',
+        help='store fluxes as packed shorts, like the original ERA5 files',
+    )
+    args = parser.parse_args()
+
+    # load config
+    config = yaml.safe_load(open(args.config))
+
+    # write the years given in config
+    for year in range(config['year_start'], config['year_end'] + 1):
+        write_year(year, config, args.resolution,
+                   ars_per_day=args.ars_per_day, seed=args.seed,
+                   packed=args.packed)
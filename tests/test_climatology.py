@@ -0,0 +1,133 @@
+import os
+import importlib.util
+
+import numpy as np
+import pandas as pd
+from netCDF4 import Dataset
+
+scripts_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location(
+    'ar_climatology', os.path.join(scripts_folder, '09_ar_climatology.py'))
+climatology = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(climatology)
+
+continents = ['Europe', 'Africa']
+
+
+def write_nc(path, varid, data, times):
+    """A (time, latitude, longitude) variable with a time axis."""
+
+    with Dataset(path, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('latitude', data.shape[1])
+        ds.createDimension('longitude', data.shape[2])
+        time = ds.createVariable('time', 'f8', ('time',))
+        time.units = 'hours since 1900-01-01'
+        time[:] = (times - pd.Timestamp(1900, 1, 1)) / pd.Timedelta('1h')
+        ds.createVariable('latitude', 'f4', ('latitude',))[:] = [10, 20]
+        ds.createVariable('longitude', 'f4', ('longitude',))[:] = [0, 1, 2]
+        ds.createVariable(varid, data.dtype,
+                          ('time', 'latitude', 'longitude'))[:] = data
+
+
+def synthetic_year(year, config, landfall=True):
+    """6-hourly THR and label files of <year>, with ARs in January only: at
+    grid cell (0, 0) at all time steps, at (1, 1) at every other one. IVT is
+    20 at (0, 0) and 10 elsewhere.
+    """
+
+    folder = os.path.join(config['output_folder'], 'ipart')
+    times = pd.date_range(f'{year}-01-01 03:00', f'{year}-12-31 21:00',
+                          freq='6h')
+    ivt = np.full((len(times), 2, 3), 10.)
+    ivt[:, 0, 0] = 20.
+    write_nc(os.path.join(folder, 'thr', f'{year}-THR-kernel-t16-s6.nc'),
+             'ivt', ivt, times)
+
+    lab_times = times[times.month == 1]
+    labels = np.zeros((len(lab_times), 2, 3), dtype=np.int32)
+    labels[:, 0, 0] = 1
+    labels[::2, 1, 1] = 2
+    write_nc(os.path.join(folder, 'ar', f'{year}_labels_angles_ivt.nc'),
+             'labels', labels, lab_times)
+
+    # 3 landfalls in Europe (of higher priority than Africa) in January,
+    # 1 in Africa in March, and one record without landfall
+    if landfall:
+        pd.DataFrame({
+            'time': pd.to_datetime([f'{year}-01-02', f'{year}-01-03',
+                                    f'{year}-01-04', f'{year}-03-01',
+                                    f'{year}-03-02']),
+            'id': [1, 1, 1, 1, 1],
+            'lf_ivt': [500., 600., 700., 400., np.nan],
+            'Europe': [10., 5., 1., 0., 0.],
+            'Africa': [1., 0., 0., 20., 0.],
+        }).to_pickle(os.path.join(config['output_folder'], 'AR_parts',
+                                  f'{year}.pkl'))
+
+
+def make_config(tmp_path):
+    config = {
+        'output_folder': str(tmp_path),
+        'kernel': [16, 6, 6],
+        'landfall_continent_priority': continents,
+    }
+    for folder in ['ipart/thr', 'ipart/ar', 'AR_parts']:
+        os.makedirs(tmp_path / folder)
+
+    return config
+
+
+def test_accumulate_year(tmp_path):
+    config = make_config(tmp_path)
+    synthetic_year(2000, config)
+    ds = climatology.accumulate_year(2000, config, chunk=50)
+
+    # leap year
+    assert ds['n_time'].sel(month=2) == 29 * 4
+    assert ds['n_time'].sum() == 366 * 4
+    assert (ds['ar_count'].sel(month=1).values ==
+            [[124, 0, 0], [0, 62, 0]]).all()
+    assert ds['ar_count'].sel(month=slice(2, 12)).sum() == 0
+    assert ds['ivt_ar_sum'].sel(month=1, latitude=10, longitude=0) == \
+        124 * 20
+    assert (ds['landfall_count'].sel(continent='Europe').values ==
+            [3] + [0] * 11).all()
+    assert (ds['landfall_count'].sel(continent='Africa').values ==
+            [0, 0, 1] + [0] * 9).all()
+
+
+def test_merge(tmp_path):
+    config = make_config(tmp_path)
+    paths = []
+    for year, landfall in [(2000, False), (2001, True), (2002, True)]:
+        synthetic_year(year, config, landfall)
+        ds = climatology.accumulate_year(year, config, chunk=50)
+        assert ('landfall_count' in ds) == landfall
+        path = str(tmp_path / f'{year}.nc')
+        ds.to_netcdf(path)
+        paths.append(path)
+
+    total = climatology.merge(paths)
+    assert total.attrs['years'] == '2000,2001,2002'
+
+    # n_time and frequencies, monthly, seasonal and annual
+    assert total['n_time'].sel(period='02') == (29 + 28 + 28) * 4
+    n_year = (366 + 365 + 365) * 4
+    assert total['n_time'].sel(period='annual') == n_year
+    freq = total['ar_frequency']
+    assert (freq.sel(period='01').values ==
+            [[1, 0, 0], [0, 0.5, 0]]).all()
+    assert (freq.sel(period='JJA') == 0).all()
+    n_djf = (3 * 31 + 3 * 31 + 29 + 28 + 28) * 4
+    np.testing.assert_allclose(freq.sel(period='DJF').values[0, 0],
+                               3 * 124 / n_djf)
+    np.testing.assert_allclose(freq.sel(period='annual').values[0, 0],
+                               3 * 124 / n_year)
+    assert total['ivt_ar_mean'].sel(period='01').values[0, 0] == 20
+    assert total['ivt_mean'].sel(period='annual').values[1, 2] == 10
+
+    # the year without landfall counts as 0
+    lf = total['landfall_count'].sel(period='annual')
+    assert lf.sel(continent='Europe') == 6
+    assert lf.sel(continent='Africa') == 2
@@ -0,0 +1,107 @@
+import os
+import sys
+import importlib.util
+
+import pytest
+import yaml
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+pytest.importorskip('ipart')
+
+scripts_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, scripts_folder)
+from synthetic_ivt import draw_filaments, synthetic_flux  # noqa: E402
+
+
+def load_script(script):
+    """Import one of the numbered scripts as a module."""
+
+    spec = importlib.util.spec_from_file_location(
+        'artracks_' + os.path.splitext(script)[0],
+        os.path.join(scripts_folder, script))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+thr = load_script('03_ipart_ar_tracking_thr_multifile.py')
+detection = load_script('04_ipart_ar_tracking_detection.py')
+
+
+@pytest.fixture(scope='module')
+def config(tmp_path_factory):
+    """Config of a run on 20 days of synthetic 6-hourly global ivt per
+    year, with the THR of the first year computed.
+    """
+
+    folder = tmp_path_factory.mktemp('output')
+    config = yaml.safe_load(open(os.path.join(scripts_folder, 'config.yml')))
+    config.update({
+        'output_folder': str(folder),
+        'year_start': 2000,
+        'year_end': 2001,
+        'kernel': [4, 2, 2],
+        'thr_halo': 16,
+        'do_regridding': True,
+        'min_area': 5e5,
+    })
+
+    # synthetic ivt
+    os.makedirs(folder / 'ivt_regridded')
+    rng = np.random.default_rng(1)
+    lat = np.arange(90, -92.5, -2.5)
+    lon = np.arange(0, 360, 2.5)
+    nhours = 20 * 24
+    filaments = draw_filaments(rng, 2 * nhours, 3.)
+    for k, year in enumerate([2000, 2001]):
+        hours = np.arange(k * nhours, (k + 1) * nhours, 6.)
+        u, v = synthetic_flux(hours, lat, lon, filaments, rng)
+        dims = ('time', 'latitude', 'longitude')
+        ds = xr.Dataset(
+            {'uflux': (dims, u), 'vflux': (dims, v),
+             'ivt': (dims, np.hypot(u, v))},
+            coords={'time': pd.Timestamp(year, 1, 1) +
+                    pd.to_timedelta(hours - k * nhours, 'h'),
+                    'latitude': lat, 'longitude': lon})
+        ds.to_netcdf(folder / 'ivt_regridded' / f'{year}.nc', encoding={
+            var: {'_FillValue': None} for var in
+            ['latitude', 'longitude', 'uflux', 'vflux', 'ivt']})
+
+    thr.thr_year(2000, config)
+
+    return config
+
+
+def read_records(path):
+    if os.path.getsize(path) == 0:
+        return pd.DataFrame()
+    return pd.read_csv(path, dtype=str)
+
+
+@pytest.mark.parametrize('sweep', [
+    {},
+    {'min_LW': [1.5, 2], 'min_length': [1500, 2000]},
+])
+def test_sweep_equals_detect_year(config, sweep):
+    config = dict(config, sweep=sweep)
+    detection.sweep_year(2000, config)
+
+    sets = detection.parameter_sets(config)
+    assert len(sets) == max(1, np.prod([len(v) for v in sweep.values()]))
+    n = 0
+    for name, param_dict in sets.items():
+        detection.detect_year(2000, dict(config, **{
+            k: param_dict[k] for k in sweep}))
+        expected = read_records(os.path.join(
+            config['output_folder'], 'ipart', 'ar', '2000_ar_records.csv'))
+        records = read_records(os.path.join(
+            config['output_folder'], 'ipart', 'ar_sweep', name,
+            '2000_ar_records.csv'))
+        pd.testing.assert_frame_equal(records, expected)
+        n += len(records)
+
+    # the synthetic data have ARs
+    assert n > 0
@@ -0,0 +1,149 @@
+import os
+import sys
+import importlib
+import threading
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from netCDF4 import Dataset
+
+# importable by name, such that the merge process can unpickle merge_chunks
+scripts_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, scripts_folder)
+download = importlib.import_module('00_download_ERA5_ivt')
+
+
+def write_packed_chunk(path, values, t0, scale_factor, add_offset):
+    """A chunk like the ones of the new CDS, packed as int16, with time
+    dimension "valid_time" and the extra variables "number" and "expver".
+    """
+
+    with Dataset(path, 'w') as ds:
+        ds.createDimension('valid_time', values.shape[0])
+        ds.createDimension('latitude', values.shape[1])
+        ds.createDimension('longitude', values.shape[2])
+        time = ds.createVariable('valid_time', 'i8', ('valid_time',))
+        time.units = 'hours since 1980-01-01'
+        time[:] = t0 + np.arange(values.shape[0])
+        ds.createVariable('latitude', 'f8', ('latitude',))[:] = \
+            np.linspace(90, -90, values.shape[1])
+        ds.createVariable('longitude', 'f8', ('longitude',))[:] = \
+            np.linspace(0, 360, values.shape[2], endpoint=False)
+        ds.createVariable('number', 'i8', ())[:] = 0
+        expver = ds.createVariable('expver', str, ('valid_time',))
+        for i in range(values.shape[0]):
+            expver[i] = '0001'
+        var = ds.createVariable('p71.162', 'i2',
+                                ('valid_time', 'latitude', 'longitude'),
+                                fill_value=-32767)
+        var.scale_factor = scale_factor
+        var.add_offset = add_offset
+        var[:] = values
+
+
+def test_merge_chunks_different_packing(tmp_path):
+    rng = np.random.default_rng(0)
+    shape = (6, 5, 8)
+    values = [rng.uniform(-100, 100, shape),
+              rng.uniform(-1000, 2500, shape)]
+    packing = [(0.01, 0.), (0.06, 700.)]
+
+    paths = []
+    for k, (vals, (scale_factor, add_offset)) in enumerate(
+            zip(values, packing)):
+        path = str(tmp_path / f'1980_{k + 1:02d}-{k + 1:02d}.nc')
+        write_packed_chunk(path, vals, k * shape[0], scale_factor,
+                           add_offset)
+        paths.append(path)
+
+    path_out = str(tmp_path / '1980.nc')
+    download.merge_chunks(paths, path_out, 2 * shape[0])
+
+    assert not any(os.path.exists(path) for path in paths)
+    with xr.open_dataset(path_out) as ds:
+        # as expected by 01_regrid_ivt.py
+        assert list(ds.data_vars) == ['p71.162']
+        assert ds['p71.162'].dims == ('time', 'latitude', 'longitude')
+        assert ds.time.values[0] == np.datetime64('1980-01-01')
+        merged = ds['p71.162'].values
+        assert merged.dtype == np.float32
+    for k, ((scale_factor, _), vals) in enumerate(zip(packing, values)):
+        np.testing.assert_allclose(merged[k * shape[0]:(k + 1) * shape[0]],
+                                   vals, atol=scale_factor)
+
+
+class StandInClient:
+    """Offline stand-in for cdsapi.Client, writing a packed chunk with the
+    value 100 * month (+ 1 for the northward flux) for each request. The
+    first request of each month in <fail> raises.
+    """
+
+    calls = Counter()
+    fail = set()
+    lock = threading.Lock()
+
+    def retrieve(self, name, request, target):
+        year = int(request['year'])
+        months = [int(month) for month in request['month']]
+        north = 'northward' in request['variable']
+        with self.lock:
+            self.calls[(north, months[0])] += 1
+            if (north, months[0]) in self.fail:
+                self.fail.remove((north, months[0]))
+                raise ConnectionError('stand-in failure')
+
+        start = pd.Timestamp(year, months[0], 1)
+        t0 = (start - pd.Timestamp(1980, 1, 1)) // pd.Timedelta('1h')
+        values = np.concatenate([
+            np.full((download.expected_hours(year, [month]), 2, 3),
+                    100. * month + north) for month in months])
+        with download.nc_lock:
+            write_packed_chunk(target, values, t0, 0.1 * months[0],
+                               100. * months[0])
+
+
+def test_download(tmp_path):
+    config = {
+        'year_start': 1980,
+        'year_end': 1980,
+        'data_folder_e': str(tmp_path / 'e'),
+        'data_folder_n': str(tmp_path / 'n'),
+    }
+    get_client = download.client_factory(f'{__name__}:StandInClient')
+
+    # an already complete chunk, and a broken one of an interrupted run
+    chunks = os.path.join(config['data_folder_e'], 'chunks')
+    os.makedirs(chunks)
+    StandInClient().retrieve('', download.chunk_request(
+        download.variables[0], 1980, [1, 2, 3]),
+        os.path.join(chunks, '1980_01-03.nc'))
+    with open(os.path.join(chunks, '1980_04-06.nc'), 'w') as f:
+        f.write('interrupted')
+    StandInClient.calls.clear()
+
+    # one failing request, retried
+    StandInClient.fail = {(True, 7)}
+    download.download(config, get_client, months_per_chunk=3, workers=2,
+                      retries=1, backoff=0)
+
+    # the complete chunk is skipped, the broken one downloaded again
+    assert StandInClient.calls[(False, 1)] == 0
+    assert StandInClient.calls[(False, 4)] == 1
+    assert StandInClient.calls[(True, 7)] == 2
+    assert sum(StandInClient.calls.values()) == 8
+
+    for folder, north in [('e', 0), ('n', 1)]:
+        assert os.listdir(tmp_path / folder / 'chunks') == []
+        with xr.open_dataset(tmp_path / folder / '1980.nc') as ds:
+            assert ds.time.size == 366 * 24
+            flux = ds['p71.162'].isel(latitude=0, longitude=0)
+            expected = 100. * ds.time.dt.month + north
+            np.testing.assert_allclose(flux, expected, atol=0.5)
+
+    # the complete years are skipped
+    StandInClient.calls.clear()
+    download.download(config, get_client, months_per_chunk=3, workers=2,
+                      retries=1, backoff=0)
+    assert sum(StandInClient.calls.values()) == 0
@@ -0,0 +1,74 @@
+import os
+import importlib.util
+
+import pytest
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+scripts_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location(
+    'regrid_ivt', os.path.join(scripts_folder, '01_regrid_ivt.py'))
+regrid = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(regrid)
+
+
+def hourly_day(seed=0):
+    """One day of synthetic hourly uflux/vflux on a small global grid."""
+
+    rng = np.random.default_rng(seed)
+    time = pd.date_range('1980-01-01', periods=24, freq='h')
+    lats = np.arange(90, -91, -30.)
+    lons = np.arange(0, 360, 30.)
+    dims = ('time', 'latitude', 'longitude')
+    shape = (len(time), len(lats), len(lons))
+
+    return xr.Dataset(
+        {'uflux': (dims, rng.normal(0, 300, shape)),
+         'vflux': (dims, rng.normal(0, 300, shape))},
+        coords={'time': time, 'latitude': lats, 'longitude': lons})
+
+
+def coarsen(ds):
+    """A small linear regridder, averaging blocks of 2x2 grid points."""
+    return ds.isel(latitude=slice(0, 6)).coarsen(
+        latitude=2, longitude=2).mean()
+
+
+@pytest.mark.parametrize('regridder', [lambda ds: ds, coarsen])
+def test_regrid_modes_equivalent(regridder):
+    dst = hourly_day()
+    rels = regrid.compare_modes(dst, regridder, 6)
+    assert all(rel < 1e-12 for rel in rels.values())
+
+
+@pytest.mark.parametrize('temporal_resolution', [1, 3, 6, 12, 24])
+def test_regrid_modes_labels(temporal_resolution):
+    dst = hourly_day()
+    a = regrid.regrid_day(dst.copy(), coarsen, temporal_resolution,
+                          'regrid_first')
+    b = regrid.regrid_day(dst.copy(), coarsen, temporal_resolution,
+                          'resample_first')
+    # labelled by the middle of the windows
+    offset = pd.Timedelta(hours=temporal_resolution / 2)
+    expected = dst.time.values[::temporal_resolution] + offset
+    assert (a.time.values == expected).all()
+    assert (b.time.values == expected).all()
+    xr.testing.assert_allclose(a, b[list(a.data_vars)], rtol=1e-12)
+
+
+@pytest.mark.parametrize('regrid_mode', ['regrid_first', 'resample_first'])
+def test_temporal_resolution_not_dividing_a_day(regrid_mode):
+    with pytest.raises(ValueError, match='must divide 24'):
+        regrid.regrid_day(hourly_day(), coarsen, 5, regrid_mode)
+
+
+def test_resample_ivt():
+    dst = hourly_day()
+    ds = regrid.resample_ivt(dst, 6)
+    assert (ds.time.values == dst.time.values[3::6]).all()
+    ivt = np.hypot(dst['uflux'], dst['vflux'])
+    np.testing.assert_allclose(ds['ivt'].values[1],
+                               ivt.values[6:12].mean(axis=0))
+    np.testing.assert_allclose(ds['uflux'].values[1],
+                               dst['uflux'].values[6:12].mean(axis=0))
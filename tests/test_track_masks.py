@@ -0,0 +1,123 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from netCDF4 import Dataset
+
+scripts_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, scripts_folder)
+from track_masks import (  # noqa: E402
+    bbox_columns, circular_extent, label_bboxes, get_track_masks)
+
+nx = 12
+
+
+def test_circular_extent():
+    cols = np.zeros(nx, dtype=bool)
+    assert circular_extent(cols) == (0, 0)
+    cols[3:6] = True
+    assert circular_extent(cols) == (3, 6)
+    # wrapping around the longitude bounds
+    cols[:] = False
+    cols[[10, 11, 0, 1]] = True
+    assert circular_extent(cols) == (10, 2)
+    # the largest gap decides
+    cols[5] = True
+    assert circular_extent(cols) == (10, 6)
+    cols[:] = True
+    assert circular_extent(cols) == (0, nx)
+
+
+def test_label_bboxes():
+    labels = np.zeros((4, nx), dtype=np.int32)
+    # label 1 crosses the antimeridian, label 2 does not
+    labels[1:3, [11, 0, 1]] = 1
+    labels[0, 4:7] = 2
+    labels[2:4, 5] = 2
+
+    assert label_bboxes(labels, [1, 2]) == [(1, 3, 11, 2), (0, 4, 4, 7)]
+    assert label_bboxes(labels, [1, 2], zonal_cyclic=False) == \
+        [(1, 3, 0, nx), (0, 4, 4, 7)]
+
+
+def write_track(folder, labels, ivt, zonal_cyclic):
+    """Label/THR files of 2000 with one AR (id 1) per time step, forming
+    track 0, and the track and bounding box tables.
+    """
+
+    ar_folder = os.path.join(folder, 'ipart', 'ar')
+    thr_folder = os.path.join(folder, 'ipart', 'thr')
+    os.makedirs(ar_folder)
+    os.makedirs(thr_folder)
+
+    times = pd.date_range('2000-01-01 03:00', periods=len(labels),
+                          freq='6h')
+    for path, varid, data in [
+            (os.path.join(ar_folder, '2000_labels_angles_ivt.nc'), 'labels',
+             labels),
+            (os.path.join(thr_folder, '2000-THR-kernel-t16-s6.nc'), 'ivt',
+             ivt)]:
+        with Dataset(path, 'w') as ds:
+            ds.createDimension('time', None)
+            ds.createDimension('latitude', data.shape[1])
+            ds.createDimension('longitude', data.shape[2])
+            ds.createVariable('latitude', 'f4', ('latitude',))[:] = \
+                np.arange(data.shape[1]) * 10.
+            ds.createVariable('longitude', 'f4', ('longitude',))[:] = \
+                np.arange(data.shape[2]) * 30.
+            ds.createVariable(varid, data.dtype,
+                              ('time', 'latitude', 'longitude'))[:] = data
+
+    pd.DataFrame({'time': times, 'id': 1, 'trackid': 0}).to_pickle(
+        os.path.join(ar_folder, 'ar_tracks.pkl'))
+    rows = []
+    for t, time in enumerate(times):
+        box = label_bboxes(labels[t], [1], zonal_cyclic)[0]
+        rows.append((time, 1, t, t) + box)
+    pd.DataFrame(rows, columns=bbox_columns).to_pickle(
+        os.path.join(ar_folder, '2000_label_bbox.pkl'))
+
+
+def synthetic_track():
+    """An AR at the east edge, then crossing the antimeridian."""
+
+    labels = np.zeros((2, 5, nx), dtype=np.int32)
+    labels[0, 1:3, 8:10] = 1
+    labels[1, 2:4, [10, 11, 0]] = 1
+    ivt = np.arange(2 * 5 * nx, dtype=np.float32).reshape(2, 5, nx)
+
+    return labels, ivt
+
+
+def test_get_track_masks_wrapping(tmp_path):
+    labels, ivt = synthetic_track()
+    write_track(str(tmp_path), labels, ivt, zonal_cyclic=True)
+    config = {'output_folder': str(tmp_path), 'kernel': [16, 6, 6],
+              'zonal_cyclic': True, 'domain': None}
+
+    ds = get_track_masks(0, config)
+
+    # union box wraps from the east edge to the west edge
+    xidx = [8, 9, 10, 11, 0]
+    assert (ds['longitude'].values == np.array(xidx) * 30.).all()
+    assert (ds['latitude'].values == [10, 20, 30]).all()
+    np.testing.assert_array_equal(ds['mask'].values,
+                                  labels[:, 1:4][:, :, xidx] == 1)
+    np.testing.assert_array_equal(ds['ivt'].values, ivt[:, 1:4][:, :, xidx])
+
+
+def test_get_track_masks_regional(tmp_path):
+    # a regional domain is not cyclic, the box must not wrap
+    labels = np.zeros((2, 5, nx), dtype=np.int32)
+    labels[0, 1:3, 10:12] = 1
+    labels[1, 1:3, 0:2] = 1
+    ivt = np.ones((2, 5, nx), dtype=np.float32)
+    write_track(str(tmp_path), labels, ivt, zonal_cyclic=False)
+    config = {'output_folder': str(tmp_path), 'kernel': [16, 6, 6],
+              'zonal_cyclic': True, 'domain': [0, 40, -30, 300]}
+
+    ds = get_track_masks(0, config)
+
+    assert (ds['longitude'].values == np.arange(nx) * 30.).all()
+    np.testing.assert_array_equal(ds['mask'].values, labels[:, 1:3] == 1)
@@ -0,0 +1,113 @@
+import os
+import importlib.util
+
+import numpy as np
+import pandas as pd
+from shapely.geometry import Polygon, box
+
+scripts_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location(
+    'track_summary', os.path.join(scripts_folder, '10_track_summary.py'))
+summary = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(summary)
+
+
+def synthetic_records(seed=0):
+    """Records of 30 tracks of 1-8 records, sorted by trackid and time, with
+    and without landfalls.
+    """
+
+    rng = np.random.default_rng(seed)
+    n = rng.integers(1, 9, 30)
+    trackid = np.repeat(np.arange(30), n)
+    start = pd.Timestamp('2000-01-01') + \
+        pd.to_timedelta(rng.integers(0, 1000, 30) * 6, 'h')
+    time = np.concatenate([s + pd.to_timedelta(np.arange(k) * 6, 'h')
+                           for s, k in zip(start, n)])
+    land = np.where(rng.uniform(size=len(trackid)) < 0.4,
+                    rng.uniform(0, 100, len(trackid)), 0.)
+    lf = land > 0
+
+    return pd.DataFrame({
+        'trackid': trackid,
+        'time': time,
+        'ar_area': rng.uniform(1e5, 1e7, len(trackid)),
+        'land': land,
+        'lf_lon': np.where(lf, rng.uniform(-180, 180, len(trackid)), np.nan),
+        'lf_lat': np.where(lf, rng.uniform(-90, 90, len(trackid)), np.nan),
+        'lf_ivt': np.where(lf, rng.uniform(250, 1500, len(trackid)), np.nan),
+    })
+
+
+def summarize_group(g):
+    """Reference summary of one track."""
+
+    lf = g.loc[g['land'] > 0]
+    return pd.Series({
+        'start': g['time'].iloc[0],
+        'end': g['time'].iloc[-1],
+        'n_records': len(g),
+        'duration': (g['time'].iloc[-1] - g['time'].iloc[0]) /
+        pd.Timedelta('1h'),
+        'lf_time': lf['time'].iloc[0] if len(lf) else pd.NaT,
+        'lf_lon': lf['lf_lon'].iloc[0] if len(lf) else np.nan,
+        'lf_lat': lf['lf_lat'].iloc[0] if len(lf) else np.nan,
+        'max_lf_ivt': g['lf_ivt'].max(),
+        'land': (g['land'] * g['ar_area']).sum() / g['ar_area'].sum(),
+        'n_landfall': (g['land'] > 0).sum(),
+    })
+
+
+def test_summarize_tracks():
+    ar = synthetic_records()
+    track = summary.summarize_tracks(ar)
+    expected = ar.groupby('trackid').apply(summarize_group).reset_index()
+
+    assert (track['trackid'] == expected['trackid']).all()
+    for col in ['start', 'end', 'lf_time']:
+        pd.testing.assert_series_equal(
+            track[col], pd.to_datetime(expected[col]).astype(
+                track[col].dtype), check_names=False)
+    for col in ['n_records', 'duration', 'lf_lon', 'lf_lat', 'max_lf_ivt',
+                'land', 'n_landfall']:
+        np.testing.assert_allclose(track[col].astype(float),
+                                   expected[col].astype(float))
+
+
+def test_summarize_tracks_empty():
+    track = summary.summarize_tracks(synthetic_records().iloc[:0])
+    assert len(track) == 0
+    assert 'max_lf_ivt' in track
+
+
+def test_split_antimeridian():
+    # contour crossing 180 deg, in longitudes [-180, 180]
+    x = [170, -170, -170, 170, 170]
+    y = [0, 0, 10, 10, 0]
+    polygon = Polygon(zip(summary.unwrap(x), y))
+    assert polygon.bounds == (170, 0, 190, 10)
+
+    swath = summary.split_antimeridian(polygon)
+    assert swath.geom_type == 'MultiPolygon'
+    assert swath.equals(box(170, 0, 180, 10).union(box(-180, 0, -170, 10)))
+
+    # a contour not crossing 180 deg stays a Polygon
+    polygon = box(-20, 0, 20, 10)
+    assert summary.split_antimeridian(polygon).equals(polygon)
+
+
+def test_track_swaths():
+    # track 0 crosses 180 deg, track 1 does not
+    contours_x = [np.array([170, 178, 178, 170, 170.]),
+                  np.array([175, -175, -175, 175, 175.]),
+                  np.array([0, 10, 10, 0, 0.])]
+    contours_y = [np.array([0, 0, 10, 10, 0.])] * 3
+    swaths, areas = summary.track_swaths(contours_x, contours_y, [2, 1])
+
+    assert swaths[0].geom_type == 'MultiPolygon'
+    assert swaths[0].equals(box(170, 0, 180, 10).union(
+        box(-180, 0, -175, 10)))
+    assert swaths[1].geom_type == 'Polygon'
+    # 15 and 10 degrees wide boxes at the same latitudes, with geodesic
+    # edges
+    np.testing.assert_allclose(areas[0] / areas[1], 1.5, rtol=1e-2)
@@ -0,0 +1,73 @@
+import os
+import sys
+import importlib.util
+
+import pytest
+import numpy as np
+import pandas as pd
+
+pytest.importorskip('ipart')
+from ipart.AR_tracer import trackARs  # noqa: E402
+
+scripts_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location(
+    'trace_over_time',
+    os.path.join(scripts_folder, '05_ipart_ar_tracking_trace_over_time.py'))
+trace = importlib.util.module_from_spec(spec)
+# registered, such that the worker processes can unpickle its functions
+sys.modules[spec.name] = trace
+spec.loader.exec_module(trace)
+
+
+def synthetic_records(seed=0):
+    """AR-like records of eastward moving systems over the turns of the years
+    1999/2000 to 2001/2002, with missing time steps.
+    """
+
+    rng = np.random.default_rng(seed)
+    rows = []
+    for year in [2000, 2001, 2002]:
+        systems = []
+        for time in pd.date_range(f'{year - 1}-12-27', f'{year}-01-05',
+                                  freq='6h'):
+            # new systems, moving systems, dying systems
+            for _ in range(rng.poisson(0.6)):
+                systems.append([rng.uniform(-60, 60), rng.uniform(0, 200),
+                                rng.integers(2, 24)])
+            for system in systems:
+                system[1] += rng.normal(4, 2)
+                system[2] -= 1
+            systems = [system for system in systems if system[2] > 0]
+            if rng.uniform() < 0.05:
+                continue
+            for i, (lat, lon, _) in enumerate(systems):
+                rows.append({
+                    'id': i + 1,
+                    'time': time,
+                    'centroid_y': lat + 5,
+                    'centroid_x': lon + 10,
+                    'axis_y': np.linspace(lat, lat + 10, 10),
+                    'axis_x': np.linspace(lon, lon + 20, 10),
+                })
+
+    return pd.DataFrame(rows)
+
+
+def track_table(track_list):
+    """(time, id, trackid) of the tracks, numbered as in 05."""
+    return pd.concat([tr.data[['time', 'id']].assign(trackid=i)
+                      for i, tr in enumerate(track_list)], ignore_index=True)
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_segmented_equals_serial(seed):
+    ardf = synthetic_records(seed)
+    config = {'TIME_GAP_ALLOW': 6, 'MAX_DIST_ALLOW': 1200,
+              'TRACK_SCHEME': 'simple'}
+
+    serial = trackARs(ardf.copy(), 6, 1200, verbose=False)
+    segmented = trace.track_segmented(ardf.copy(), config, segment_years=1,
+                                      workers=2)
+
+    pd.testing.assert_frame_equal(track_table(serial),
+                                  track_table(segmented))
@@ -0,0 +1,223 @@
+# Copyright (C) 2022 by
+# Dominik Traxl <dominik.traxl@posteo.org>
+# All rights reserved.
+# GPL-3.0 license.
+
+"""Retrieve the gridded footprint of an AR track.
+
+"04_ipart_ar_tracking_detection.py" stores, next to the label file of each
+year, an index "{year}_label_bbox.pkl" with the bounding box (in grid space)
+of every AR record. Using this index, the masks and IVT values of a track
+are read from the label and THR files hyperslab by hyperslab, instead of
+scanning the global fields of every time step.
+
+Usage from python
+
+    import yaml
+    from track_masks import get_track_masks
+
+    config = yaml.safe_load(open('config.yml'))
+    ds = get_track_masks(89162, config)
+"""
+
+import os
+import argparse
+from functools import lru_cache
+
+import yaml
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy.ndimage import find_objects
+from netCDF4 import Dataset
+
+from domain import get_domain, is_cyclic
+
+# columns of the bounding box index
+bbox_columns = ['time', 'id', 'tidx', 'lidx', 'y0', 'y1', 'x0', 'x1']
+
+
+def circular_extent(cols):
+    """Smallest zonally cyclic interval [x0, x1) covering all True entries of
+    <cols>. x0 > x1 if the interval wraps around the longitude bounds.
+    """
+
+    occ = np.flatnonzero(cols)
+    nx = len(cols)
+    if len(occ) == 0:
+        return 0, 0
+    if len(occ) == nx:
+        return 0, nx
+
+    # the interval is the complement of the largest gap
+    gaps = np.diff(np.r_[occ, occ[0] + nx])
+    k = np.argmax(gaps)
+    x0 = occ[(k + 1) % len(occ)]
+    x1 = occ[k] + 1
+
+    return x0, x1
+
+
+def label_bboxes(labels, ids, zonal_cyclic=True):
+    """Bounding boxes (y0, y1, x0, x1) of the labels <ids> of a 2D label
+    array. With <zonal_cyclic>, boxes of labels crossing the longitude
+    bounds wrap around, i.e. x0 > x1.
+    """
+
+    nx = labels.shape[1]
+    slices = find_objects(labels.astype(np.int64))
+    bboxes = []
+    for i in ids:
+        sy, sx = slices[i - 1]
+        x0, x1 = sx.start, sx.stop
+        if zonal_cyclic and x0 == 0 and x1 == nx:
+            x0, x1 = circular_extent((labels[sy] == i).any(axis=0))
+        bboxes.append((sy.start, sy.stop, x0, x1))
+
+    return bboxes
+
+
+def read_box(var, index, y0, y1, x0, x1):
+    """Read the hyperslab var[index, y0:y1, x0:x1] of a netcdf variable,
+    wrapping around the last axis if x0 > x1.
+    """
+
+    if x0 < x1:
+        return var[index, y0:y1, x0:x1]
+
+    return np.ma.concatenate([var[index, y0:y1, x0:],
+                              var[index, y0:y1, :x1]], axis=-1)
+
+
+@lru_cache(maxsize=None)
+def load_tracks(path):
+    """Load the AR tracks, once per process."""
+    return pd.read_pickle(path)[['time', 'id', 'trackid']]
+
+
+@lru_cache(maxsize=None)
+def load_index(path):
+    """Load the bounding box index of a year, once per process."""
+    return pd.read_pickle(path)
+
+
+def get_track_masks(trackid, config):
+    """Cropped masks and IVT of the track <trackid>.
+
+    Returns a xarray.Dataset on the smallest lat/lon box (in the grid and
+    longitude convention of the THR output) covering all ARs of the track,
+    with variables
+
+    - mask: True where the grid cell belongs to the AR of the track
+    - ivt: the IVT of the THR output within the box
+    """
+
+    output_folder = config['output_folder']
+    ar_folder = os.path.join(output_folder, 'ipart', 'ar')
+    t, s = config['kernel'][:2]
+
+    # records of the track, with their position in the label/thr files
+    tracks = load_tracks(os.path.join(ar_folder, 'ar_tracks.pkl'))
+    track = tracks.loc[tracks['trackid'] == trackid]
+    if len(track) == 0:
+        raise ValueError(f'no track with trackid {trackid}')
+    track = pd.concat([
+        pd.merge(track, load_index(os.path.join(
+            ar_folder, f'{year}_label_bbox.pkl')), on=['time', 'id'])
+        for year in track['time'].dt.year.unique()
+    ]).sort_values('time', ignore_index=True)
+    assert len(track) == tracks['trackid'].eq(trackid).sum()
+
+    # union of the boxes, wrapping around only for zonally cyclic data
+    year = track['time'].dt.year.iloc[0]
+    with Dataset(os.path.join(ar_folder,
+                              f'{year}_labels_angles_ivt.nc')) as flab:
+        ny, nx = flab.variables['labels'].shape[1:]
+    y0, y1 = track['y0'].min(), track['y1'].max()
+    if config['zonal_cyclic'] and is_cyclic(get_domain(config)):
+        cols = np.zeros(nx, dtype=bool)
+        for x0, x1 in zip(track['x0'], track['x1']):
+            if x0 < x1:
+                cols[x0:x1] = True
+            else:
+                cols[x0:] = True
+                cols[:x1] = True
+        x0, x1 = circular_extent(cols)
+    else:
+        x0, x1 = track['x0'].min(), track['x1'].max()
+    if x0 < x1:
+        xidx = np.arange(x0, x1)
+    else:
+        xidx = np.r_[np.arange(x0, nx), np.arange(x1)]
+
+    # read the hyperslabs, year by year
+    mask = np.zeros((len(track), y1 - y0, len(xidx)), dtype=bool)
+    ivt = np.zeros((len(track), y1 - y0, len(xidx)), dtype=np.float32)
+    for year, records in track.groupby(track['time'].dt.year):
+        flab = Dataset(os.path.join(ar_folder,
+                                    f'{year}_labels_angles_ivt.nc'))
+        fthr = Dataset(os.path.join(
+            output_folder, 'ipart', 'thr',
+            f'{year}-THR-kernel-t{t}-s{s}.nc'))
+        assert fthr.variables['ivt'].shape[1:] == (ny, nx)
+        for i, rec in records.iterrows():
+            # position of the record's box within the union box
+            dx = (rec['x0'] - x0) % nx
+            width = (rec['x1'] - rec['x0']) % nx or nx
+            dy = rec['y0'] - y0
+            box = (rec['y0'], rec['y1'], rec['x0'], rec['x1'])
+            lab = np.ma.filled(
+                read_box(flab.variables['labels'], rec['lidx'], *box), 0)
+            mask[i, dy:dy + lab.shape[0], dx:dx + width] = lab == rec['id']
+            ivt[i] = np.ma.filled(
+                read_box(fthr.variables['ivt'], rec['tidx'], y0, y1, x0, x1),
+                np.nan)
+        ydim, xdim = fthr.variables['ivt'].dimensions[1:]
+        lat = fthr.variables[ydim][y0:y1]
+        lon = fthr.variables[xdim][:][xidx]
+        flab.close()
+        fthr.close()
+
+    return xr.Dataset(
+        data_vars={
+            'mask': (('time', 'latitude', 'longitude'), mask),
+            'ivt': (('time', 'latitude', 'longitude'), ivt),
+        },
+        coords={'time': track['time'].values, 'id': ('time', track['id']),
+                'latitude': np.asarray(lat), 'longitude': np.asarray(lon)},
+        attrs={'trackid': trackid},
+    )
+
+
+if __name__ == '__main__':
+
+    # argument parameters
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        'trackid',
+        type=int,
+        help='trackid of the track',
+    )
+    parser.add_argument(
+        '--config', '-c',
+        type=str,
+        help='path to the config.yml file',
+        default=os.path.join(os.getcwd(), 'config.yml'),
+    )
+    parser.add_argument(
+        '--output', '-o',
+        type=str,
+        help='netcdf file to store the masks and ivt of the track in',
+        default='track_{trackid}.nc',
+    )
+    args = parser.parse_args()
+
+    # load config
+    config = yaml.safe_load(open(args.config))
+
+    ds = get_track_masks(args.trackid, config)
+    ds.to_netcdf(args.output.format(trackid=args.trackid), encoding={
+        v: {'zlib': True} for v in ds.data_vars})